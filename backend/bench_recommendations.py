@@ -0,0 +1,53 @@
+"""Benchmark the co-purchase index on synthetic orders.
+
+Usage: python bench_recommendations.py [orders] [products]
+"""
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from recommendations import CoPurchaseIndex
+
+
+def synthetic_baskets(orders: int, products: int, seed: int = 7):
+    """Baskets of 1-6 items drawn from a Zipf-like popularity curve"""
+    rng = np.random.default_rng(seed)
+    ids = [str(uuid.uuid4()) for _ in range(products)]
+    popularity = 1.0 / np.arange(1, products + 1) ** 1.1
+    popularity /= popularity.sum()
+    sizes = rng.integers(1, 7, size=orders)
+    picks = rng.choice(products, size=int(sizes.sum()), p=popularity)
+    baskets, offset = [], 0
+    for size in sizes.tolist():
+        baskets.append([ids[i] for i in picks[offset:offset + size].tolist()])
+        offset += size
+    return ids, baskets
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    products = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    ids, baskets = synthetic_baskets(orders, products)
+    index = CoPurchaseIndex(top_k=10)
+
+    start = time.perf_counter()
+    index.rebuild(baskets)
+    print(f"rebuild: {orders} orders, {len(index.rows)} products in {time.perf_counter() - start:.2f}s")
+
+    extra = baskets[:1000]
+    start = time.perf_counter()
+    for basket in extra:
+        index.add_basket(basket)
+    print(f"add_basket: {(time.perf_counter() - start) / len(extra) * 1e6:.1f}us per order")
+
+    lookups = 100_000
+    start = time.perf_counter()
+    for i in range(lookups):
+        index.related(ids[i % products], 4)
+    print(f"related: {(time.perf_counter() - start) / lookups * 1e6:.2f}us per lookup")
+
+
+if __name__ == "__main__":
+    main()
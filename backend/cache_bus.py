@@ -0,0 +1,147 @@
+"""Cross-worker cache invalidation over a MongoDB capped collection"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus:
+    """Broadcasts cache invalidations to every worker through a capped collection.
+
+    Each worker tails `cache_invalidations` with a tailable-await cursor and
+    applies messages from other workers to its own in-process caches. Capped
+    collections work on a standalone mongod, so no replica set is needed.
+
+    Delivery is best effort: a message can be lost (failed insert, capped
+    collection wrap) or arrive late and out of order. An invalidation only
+    drops entries, so applying one late or twice is harmless, and late
+    messages are still applied rather than discarded. A lost message leaves
+    a worker stale until the entry's TTL (analytics, settings and token
+    versions) or, for the content-addressed image cache, until eviction.
+
+    `v` is the message schema version. `seq` numbers messages per origin
+    worker so late (out-of-order) deliveries are visible in `stats()`.
+    """
+
+    VERSION = 1
+
+    def __init__(self, db, collection: str = "cache_invalidations", size_bytes: int = 1024 * 1024):
+        self.db = db
+        self.collection = collection
+        self.size_bytes = size_bytes
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.handlers: Dict[str, Any] = {}
+        self.pending: set = set()
+        self.seq = 0
+        self.last_seen: Dict[str, int] = {}  # origin -> highest seq received
+        self.published = 0
+        self.received = 0
+        self.out_of_order = 0
+        self.last_lag_ms: Optional[float] = None
+
+    def register(self, cache: str, handler):
+        """handler(*keys) drops the named entries from a local cache"""
+        self.handlers[cache] = handler
+
+    def publish(self, cache: str, *keys: str):
+        """Invalidate locally now and broadcast to the other workers"""
+        self.handlers[cache](*keys)
+        self.seq += 1
+        message = {
+            "v": self.VERSION,
+            "cache": cache,
+            "keys": list(keys),
+            "origin": self.worker_id,
+            "seq": self.seq,
+            "ts": datetime.now(timezone.utc)
+        }
+        task = asyncio.get_running_loop().create_task(self.broadcast(message))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def broadcast(self, message: dict):
+        try:
+            await self.db[self.collection].insert_one(message)
+            self.published += 1
+        except Exception as e:
+            # Other workers fall back to their TTLs for this write
+            logger.error(f"Failed to broadcast cache invalidation: {str(e)}")
+
+    def receive(self, message: dict) -> bool:
+        """Apply a message from another worker; returns whether a handler ran"""
+        origin = message.get("origin")
+        if origin in (None, self.worker_id):
+            return False
+        if message.get("v", 0) > self.VERSION:
+            logger.warning(f"Skipping cache invalidation with unsupported version {message.get('v')}")
+            return False
+        handler = self.handlers.get(message.get("cache"))
+        if handler is None:
+            return False
+
+        seq = message.get("seq")
+        if seq is not None:
+            if seq < self.last_seen.get(origin, 0):
+                self.out_of_order += 1
+            else:
+                self.last_seen[origin] = seq
+
+        self.received += 1
+        if isinstance(message.get("ts"), datetime):
+            sent = message["ts"].replace(tzinfo=timezone.utc)
+            self.last_lag_ms = (datetime.now(timezone.utc) - sent).total_seconds() * 1000
+        handler(*message.get("keys", []))
+        return True
+
+    async def ensure_collection(self):
+        try:
+            await self.db.create_collection(self.collection, capped=True, size=self.size_bytes, max=10000)
+        except CollectionInvalid:
+            pass
+        # Tailable cursors die immediately on an empty collection
+        if not await self.db[self.collection].find_one({}):
+            await self.db[self.collection].insert_one({"v": self.VERSION, "cache": None, "origin": None})
+
+    async def listen(self):
+        """Tail the collection for as long as the worker runs"""
+        await self.ensure_collection()
+        newest = await self.db[self.collection].find_one({}, sort=[("$natural", -1)])
+        since = newest["_id"]
+        while True:
+            try:
+                cursor = self.db[self.collection].find(
+                    {"_id": {"$gt": since}},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    async for message in cursor:
+                        since = max(since, message["_id"])
+                        self.receive(message)
+                    await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {str(e)}")
+            # ObjectIds from different hosts are only roughly ordered; re-read a
+            # short window when resuming, since re-applying an invalidation is harmless
+            since = ObjectId.from_datetime(since.generation_time - timedelta(seconds=2))
+            await asyncio.sleep(0.5)
+
+    def stats(self) -> dict:
+        return {
+            "workerId": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+            "outOfOrder": self.out_of_order,
+            "lastLagMs": self.last_lag_ms,
+            "caches": sorted(self.handlers)
+        }
@@ -0,0 +1,15 @@
+"""Password hashing that can run in worker processes.
+
+Kept free of app state so a ProcessPoolExecutor can import it cheaply
+under any multiprocessing start method.
+"""
+from typing import List
+
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """bcrypt-hash a batch of passwords"""
+    return [pwd_context.hash(password) for password in passwords]
@@ -0,0 +1,102 @@
+"""Frequently-bought-together recommendations from order co-occurrence"""
+import heapq
+import threading
+from itertools import combinations
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class CoPurchaseIndex:
+    """Sparse product co-occurrence counts with a precomputed top-K table.
+
+    Full rebuilds are vectorised with NumPy; completed orders are then
+    folded in one at a time, recomputing only the rows they touch.
+    Lookups are a single dict access. Orders folded in while a rebuild is
+    running (between begin_rebuild() and the end of rebuild()) are replayed
+    into the new tables before they are swapped in.
+    """
+
+    def __init__(self, top_k: int = 10):
+        self.top_k = top_k
+        self.rows: Dict[str, Dict[str, int]] = {}  # product -> {co-purchased product: count}
+        self.top: Dict[str, List[Tuple[str, int]]] = {}
+        self.orders = 0
+        self.lock = threading.Lock()
+        self.backlog: Optional[Dict[str, List[str]]] = None  # order id -> basket, while rebuilding
+
+    def begin_rebuild(self):
+        """Start recording added baskets; call before reading the order history"""
+        with self.lock:
+            self.backlog = {}
+
+    def rebuild(self, baskets: Iterable[List[str]], order_ids: Collection[str] = ()):
+        """Recompute everything from an iterable of baskets (lists of product ids).
+
+        order_ids are the orders the baskets came from; baskets recorded since
+        begin_rebuild() for any other order are folded into the result.
+        """
+        codes: Dict[str, int] = {}
+        pairs: List[Tuple[int, int]] = []
+        orders = 0
+        for basket in baskets:
+            orders += 1
+            items = sorted({codes.setdefault(product_id, len(codes)) for product_id in basket})
+            pairs.extend(combinations(items, 2))
+
+        # Count each (a, b) pair with a < b by encoding it as a single integer key
+        size = max(len(codes), 1)
+        pair_array = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        unique, counts = np.unique(pair_array[:, 0] * size + pair_array[:, 1], return_counts=True)
+        left, right = unique // size, unique % size
+
+        # Symmetric sparse matrix in COO form, sorted by row then descending count
+        rows = np.concatenate([left, right])
+        cols = np.concatenate([right, left])
+        values = np.concatenate([counts, counts])
+        order = np.lexsort((-values, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+
+        ids = np.empty(len(codes), dtype=object)
+        for product_id, code in codes.items():
+            ids[code] = product_id
+
+        new_rows: Dict[str, Dict[str, int]] = {}
+        new_top: Dict[str, List[Tuple[str, int]]] = {}
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.array([], dtype=np.int64)
+        ends = np.r_[starts[1:], len(rows)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            product_id = ids[rows[start]]
+            neighbours = ids[cols[start:end]].tolist()
+            weights = values[start:end].tolist()
+            new_rows[product_id] = dict(zip(neighbours, weights))
+            new_top[product_id] = list(zip(neighbours[:self.top_k], weights[:self.top_k]))
+
+        # Swap in one step so concurrent readers never see a half-built table
+        with self.lock:
+            backlog, self.backlog = self.backlog or {}, None
+            for order_id, basket in backlog.items():
+                if order_id not in order_ids:
+                    self._fold(new_rows, new_top, basket)
+                    orders += 1
+            self.rows, self.top, self.orders = new_rows, new_top, orders
+
+    def add_basket(self, basket: List[str], order_id: Optional[str] = None):
+        """Fold one completed order into the counts and refresh the affected top-K rows"""
+        with self.lock:
+            if self.backlog is not None:
+                self.backlog[order_id or f"~{len(self.backlog)}"] = basket
+            self._fold(self.rows, self.top, basket)
+            self.orders += 1
+
+    def _fold(self, rows: Dict[str, Dict[str, int]], top: Dict[str, List[Tuple[str, int]]], basket: List[str]):
+        items = sorted(set(basket))
+        for a, b in combinations(items, 2):
+            rows.setdefault(a, {})[b] = rows.get(a, {}).get(b, 0) + 1
+            rows.setdefault(b, {})[a] = rows.get(b, {}).get(a, 0) + 1
+        if len(items) > 1:
+            for product_id in items:
+                top[product_id] = heapq.nlargest(self.top_k, rows[product_id].items(), key=lambda item: item[1])
+
+    def related(self, product_id: str, limit: int = 10) -> List[Tuple[str, int]]:
+        return self.top.get(product_id, [])[:limit]
@@ -1,23 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query, Body, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query, Body, UploadFile, File, Request, Header
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartParser, MultiPartException
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import UpdateOne, InsertOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from bson import ObjectId
 import os
 import logging
 import asyncio
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone, timedelta
+import hashlib
+import functools
+import time
+import re
+import csv
+from datetime import date, datetime, timezone, timedelta
 from square import Square
 from square.environment import SquareEnvironment
 import resend
-from passlib.context import CryptContext
 from jose import JWTError, jwt
+from PIL import Image, ImageOps, features as pil_features
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, deque
 import io
+import base64
+import json
+import numpy as np
+import pandas as pd
+from recommendations import CoPurchaseIndex
+from passwords import pwd_context, hash_passwords
+from cache_bus import InvalidationBus
 
 
 ROOT_DIR = Path(__file__).parent
@@ -50,9 +71,6 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'mother-natural-secret-key-change-
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
 
@@ -76,6 +94,7 @@ async def create_default_admin():
             "id": "admin-001",
             "name": "Administrator",
             "email": admin_email,
+            **user_search_fields("Administrator", admin_email),
             "hashed_password": get_password_hash(admin_password),
             "role": "admin",
             "membershipLevel": "platinum",
@@ -89,6 +108,121 @@ async def create_default_admin():
         logger.info("Default admin user already exists")
 
 
+# Long-running tasks started at startup, cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Start periodic maintenance jobs"""
+    gc_interval = float(os.environ.get("IMAGE_GC_INTERVAL_HOURS", "0"))
+    if gc_interval > 0:
+        background_tasks.append(asyncio.create_task(run_image_gc_periodically(gc_interval)))
+    if os.environ.get("ANALYTICS_SNAPSHOTS_ENABLED", "true").lower() == "true":
+        snapshot_hour = int(os.environ.get("ANALYTICS_SNAPSHOT_HOUR_UTC", "0"))
+        background_tasks.append(asyncio.create_task(run_daily_snapshots(snapshot_hour)))
+    background_tasks.append(asyncio.create_task(rebuild_recommendations()))
+    like_interval = float(os.environ.get("LIKE_FLUSH_SECONDS", "2"))
+    background_tasks.append(asyncio.create_task(flush_likes_periodically(like_interval)))
+    if os.environ.get("CACHE_BUS_ENABLED", "true").lower() == "true":
+        background_tasks.append(asyncio.create_task(invalidation_bus.listen()))
+
+
+@app.on_event("startup")
+async def create_indexes():
+    """Ensure the indexes the API relies on exist"""
+    # Uploaded images are content-addressed; variants carry no hash
+    await db["uploads.files"].create_index(
+        "metadata.sha256",
+        unique=True,
+        partialFilterExpression={"metadata.sha256": {"$exists": True}}
+    )
+    await db["uploads.files"].create_index("metadata.variant_of")
+    await db.revenue_daily.create_index([("day", 1), ("payment_type", 1)], unique=True)
+    await db.product_sales.create_index("product_id", unique=True)
+    await db.product_sales.create_index([("revenue", -1)])
+    await db.products.create_index("id")
+    
+    await db.user_cohorts.create_index("cohort", unique=True)
+    await db.user_activity.create_index([("email", 1), ("month", 1)], unique=True)
+    
+    await db.analytics_snapshots.create_index("date", unique=True)
+    await db.user_import_jobs.create_index("id", unique=True)
+    
+    # Orders are attributed to users by email
+    await db.auth_users.create_index("email")
+    
+    # Admin user directory: prefix search and filters, ordered by (name_lower, id)
+    await db.auth_users.update_many(
+        {"name_lower": {"$exists": False}},
+        [{"$set": {"name_lower": {"$toLower": "$name"}, "email_lower": {"$toLower": "$email"}}}]
+    )
+    await db.auth_users.create_index([("name_lower", 1), ("id", 1)])
+    await db.auth_users.create_index([("email_lower", 1), ("id", 1)])
+    await db.auth_users.create_index([("role", 1), ("name_lower", 1), ("id", 1)])
+    await db.auth_users.create_index([("membershipLevel", 1), ("name_lower", 1), ("id", 1)])
+    
+    # One account per email regardless of case; registrations and imports rely on it
+    try:
+        await db.auth_users.create_index(
+            "email_lower",
+            unique=True,
+            partialFilterExpression={"email_lower": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        logger.warning(f"Could not enforce unique emails, existing accounts differ only by case: {str(e)}")
+    await db.users.create_index("email")
+    
+    # Time-series range scans
+    await db.orders.create_index("created_at")
+    await db.auth_users.create_index("created_at")
+    await db.appointments.create_index("created_at")
+    await db.emergency_requests.create_index("submittedAt")
+    
+    # Triage order: most urgent first, then longest waiting
+    await db.emergency_requests.create_index([("status", 1), ("urgencyRank", 1), ("submittedAt", 1)])
+    await db.emergency_requests.create_index([("urgencyRank", 1), ("submittedAt", 1)])
+    await backfill_urgency_ranks()
+    
+    # Comments live outside their post; pages are read newest first
+    await db.community_comments.create_index("id", unique=True)
+    await db.community_comments.create_index([("postId", 1), ("date", -1), ("id", -1)])
+    await db.post_likes.create_index([("postId", 1), ("userId", 1)], unique=True)
+    await db.community_posts.create_index([("date", -1), ("id", -1)])
+    await db.community_posts.create_index([("authorId", 1), ("date", -1), ("id", -1)])
+    
+    # First start after the rollups were introduced: backfill them from existing orders
+    if await db.orders.find_one({}):
+        if not await db.revenue_daily.find_one({}):
+            try:
+                rows = await rebuild_revenue_rollup()
+                logger.info(f"Backfilled revenue rollup: {rows} rows")
+            except RollupRebuildRunning:
+                logger.info("Revenue rollup backfill is running in another worker")
+        # Counters used to be keyed by cart item id, one row per size/flavor variant;
+        # regroup them once older order items know their product
+        if await backfill_order_product_ids() or not await db.product_sales.find_one({}):
+            try:
+                rows = await rebuild_product_sales()
+                logger.info(f"Backfilled product sales: {rows} products")
+            except RollupRebuildRunning:
+                logger.info("Product sales backfill is running in another worker")
+    if not await db.user_cohorts.find_one({}):
+        try:
+            rows = await rebuild_cohorts()
+            logger.info(f"Backfilled user cohorts: {rows} cohorts")
+        except RollupRebuildRunning:
+            logger.info("User cohort backfill is running in another worker")
+    migrated = await migrate_embedded_comments()
+    if migrated:
+        logger.info(f"Moved embedded comments out of {migrated} community posts")
+
+
+# ============= CACHE INVALIDATION BUS =============
+
+invalidation_bus = InvalidationBus(db)
+
+
 # Define Models
 class StatusCheck(BaseModel):
     model_config = ConfigDict(extra="ignore")  # Ignore MongoDB's _id field
@@ -107,6 +241,7 @@ class PaymentItem(BaseModel):
     quantity: int
     price: int  # in cents
     type: str  # product, appointment, retreat
+    productId: Optional[str] = None  # catalog item a size/flavor variant belongs to
 
 class PaymentRequest(BaseModel):
     sourceId: str
@@ -193,6 +328,11 @@ class AdminCreateUserModel(BaseModel):
 # AUTHENTICATION HELPER FUNCTIONS
 # ===============================
 
+def user_search_fields(name: str, email: str) -> dict:
+    """Lowercased copies of name and email for indexed prefix search"""
+    return {"name_lower": name.lower(), "email_lower": email.lower()}
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -209,6 +349,72 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_user_token(user: dict) -> str:
+    """Access token whose claims are enough for role checks without a user lookup"""
+    return create_access_token(data={
+        "sub": user["email"],
+        "uid": user["id"],
+        "role": user.get("role", "user"),
+        "is_active": user.get("is_active", True),
+        "token_version": user.get("token_version", 0)
+    })
+
+
+class TokenVersions:
+    """LRU map of user id -> (current token_version, loaded_at).
+    
+    Bumping a user's version (role change, deactivation, password reset)
+    revokes every token issued before it. Entries are re-read after `ttl`
+    seconds, so revocation reaches every worker within the TTL even if the
+    "principal" bus message is lost.
+    """
+    
+    def __init__(self, ttl: float = 30.0, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.versions: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    async def current(self, user_id: str) -> Optional[int]:
+        entry = self.versions.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.versions.move_to_end(user_id)
+            return entry[0]
+        user = await db.auth_users.find_one({"id": user_id}, {"_id": 0, "token_version": 1})
+        if user is None:
+            self.versions.pop(user_id, None)
+            return None
+        version = user.get("token_version", 0)
+        self.set(user_id, version)
+        return version
+    
+    def set(self, user_id: str, version: int):
+        self.versions[user_id] = (version, time.monotonic())
+        self.versions.move_to_end(user_id)
+        while len(self.versions) > self.max_entries:
+            self.versions.popitem(last=False)
+    
+    def invalidate(self, *user_ids: str):
+        for user_id in user_ids:
+            self.versions.pop(user_id, None)
+
+
+token_versions = TokenVersions(ttl=float(os.environ.get("TOKEN_VERSION_TTL", "30")))
+invalidation_bus.register("principal", token_versions.invalidate)
+
+
+async def revoke_user_tokens(user_id: str):
+    """Invalidate a user's existing tokens on every worker"""
+    user = await db.auth_users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_version": 1}},
+        projection={"_id": 0, "token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidation_bus.publish("principal", user_id)
+    if user:
+        token_versions.set(user_id, user["token_version"])
+
+
 async def get_user_by_email(email: str) -> Optional[dict]:
     user = await db.auth_users.find_one({"email": email}, {"_id": 0})
     return user
@@ -268,16 +474,56 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> dict:
         )
     if not user.get("is_active", True):
         raise HTTPException(status_code=400, detail="Inactive user")
+    if "uid" in payload and payload.get("token_version") != user.get("token_version", 0):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
-async def get_current_admin_user(current_user: dict = Depends(get_current_active_user)) -> dict:
-    """Require admin role"""
-    if current_user.get("role") != "admin":
+async def get_current_admin_user(token: str = Depends(oauth2_scheme)) -> dict:
+    """Require admin role, checked from the token claims without loading the user"""
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if "uid" not in payload:
+        # Tokens issued before claims were added carry only the email
+        principal = await get_current_active_user(token)
+    else:
+        if payload.get("token_version") != await token_versions.current(payload["uid"]):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if not payload.get("is_active", True):
+            raise HTTPException(status_code=400, detail="Inactive user")
+        principal = {
+            "id": payload["uid"],
+            "email": payload.get("sub"),
+            "role": payload.get("role", "user"),
+            "is_active": True
+        }
+    
+    if principal.get("role") != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privileges required"
         )
-    return current_user
+    return principal
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
@@ -308,6 +554,7 @@ async def register_user(user_data: UserRegisterModel):
         "id": user_id,
         "name": user_data.name,
         "email": user_data.email,
+        **user_search_fields(user_data.name, user_data.email),
         "hashed_password": get_password_hash(user_data.password),
         "role": "user",
         "membershipLevel": "basic",
@@ -316,10 +563,18 @@ async def register_user(user_data: UserRegisterModel):
         "is_active": True
     }
     
-    await db.auth_users.insert_one(new_user)
+    try:
+        await db.auth_users.insert_one(new_user)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    await record_cohort_signup(now)
+    invalidation_bus.publish("analytics", "users")
     
     # Generate token
-    access_token = create_access_token(data={"sub": user_data.email})
+    access_token = create_user_token(new_user)
     
     # Return user data without password
     user_response = {
@@ -345,7 +600,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(data={"sub": user["email"]})
+    access_token = create_user_token(user)
     
     user_response = {
         "id": user["id"],
@@ -369,7 +624,7 @@ async def login_user(login_data: UserLoginModel):
             detail="Incorrect email or password"
         )
     
-    access_token = create_access_token(data={"sub": user["email"]})
+    access_token = create_user_token(user)
     
     user_response = {
         "id": user["id"],
@@ -409,6 +664,7 @@ async def update_user_profile(
     update_data = {}
     if name:
         update_data["name"] = name
+        update_data["name_lower"] = name.lower()
     if membershipLevel:
         update_data["membershipLevel"] = membershipLevel
     if profileImage is not None:
@@ -420,6 +676,7 @@ async def update_user_profile(
             {"email": current_user["email"]},
             {"$set": update_data}
         )
+        invalidation_bus.publish("analytics", "users")
     
     updated_user = await get_user_by_email(current_user["email"])
     return {
@@ -457,7 +714,10 @@ async def change_password(
         }}
     )
     
-    return {"success": True, "message": "Password changed successfully"}
+    # Tokens issued before the change (possibly stolen) stop working; hand back a fresh one
+    await revoke_user_tokens(current_user["id"])
+    user = await db.auth_users.find_one({"id": current_user["id"]}, {"_id": 0})
+    return {"success": True, "message": "Password changed successfully", "access_token": create_user_token(user)}
 
 
 # ===============================
@@ -485,6 +745,7 @@ async def admin_create_user(
         "id": user_id,
         "name": user_data.name,
         "email": user_data.email,
+        **user_search_fields(user_data.name, user_data.email),
         "hashed_password": get_password_hash(user_data.password),
         "role": user_data.role,
         "membershipLevel": user_data.membershipLevel,
@@ -494,8 +755,16 @@ async def admin_create_user(
         "created_by": current_admin["id"]
     }
     
-    await db.auth_users.insert_one(new_user)
+    try:
+        await db.auth_users.insert_one(new_user)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    await record_cohort_signup(now)
     
+    invalidation_bus.publish("analytics", "users")
     return UserResponse(
         id=user_id,
         name=user_data.name,
@@ -520,6 +789,69 @@ async def admin_get_all_users(current_admin: dict = Depends(get_current_admin_us
     ) for u in users]
 
 
+@api_router.get("/admin/users/directory")
+async def admin_user_directory(
+    q: Optional[str] = Query(default=None, description="Case-insensitive name or email prefix"),
+    search_by: Optional[str] = Query(default=None, alias="searchBy", pattern="^(name|email)$"),
+    role: Optional[str] = None,
+    membershipLevel: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_admin: dict = Depends(get_current_admin_user)
+):
+    """Page through users ordered by name (or by email when searching emails).
+    
+    A search matches one field per request, so its (field, id) index serves
+    both the prefix filter and the sort. searchBy defaults to email when q
+    contains "@". Pass nextCursor back for the next page.
+    """
+    if search_by is None:
+        search_by = "email" if q and "@" in q else "name"
+    field = f"{search_by}_lower"
+    conditions = []
+    if q:
+        conditions.append({field: {"$regex": f"^{re.escape(q.strip().lower())}"}})
+    if role:
+        conditions.append({"role": role})
+    if membershipLevel:
+        conditions.append({"membershipLevel": membershipLevel})
+    if cursor:
+        cursor_field, value, user_id = decode_cursor(cursor, size=3)
+        if cursor_field != field:
+            raise HTTPException(status_code=400, detail="Cursor does not match searchBy")
+        conditions.append({"$or": [
+            {field: {"$gt": value}},
+            {field: value, "id": {"$gt": user_id}}
+        ]})
+    
+    users = await db.auth_users.find(
+        {"$and": conditions} if conditions else {},
+        {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1, "membershipLevel": 1,
+         "joinedDate": 1, "profileImage": 1, "is_active": 1, field: 1}
+    ).sort([(field, 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(field, users[-1][field], users[-1]["id"])
+    return {
+        "users": [
+            {
+                "id": u["id"],
+                "name": u["name"],
+                "email": u["email"],
+                "role": u.get("role", "user"),
+                "membershipLevel": u.get("membershipLevel", "basic"),
+                "joinedDate": u.get("joinedDate", ""),
+                "profileImage": u.get("profileImage"),
+                "is_active": u.get("is_active", True)
+            }
+            for u in users
+        ],
+        "nextCursor": next_cursor
+    }
+
+
 @api_router.put("/admin/users/{user_id}")
 async def admin_update_user(
     user_id: str,
@@ -533,6 +865,7 @@ async def admin_update_user(
     update_data = {}
     if name is not None:
         update_data["name"] = name
+        update_data["name_lower"] = name.lower()
     if role is not None:
         update_data["role"] = role
     if membershipLevel is not None:
@@ -545,7 +878,11 @@ async def admin_update_user(
         result = await db.auth_users.update_one({"id": user_id}, {"$set": update_data})
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        if role is not None or is_active is not None:
+            # Role and active flag are carried in tokens; force a fresh login
+            await revoke_user_tokens(user_id)
     
+    invalidation_bus.publish("analytics", "users")
     return {"success": True, "message": "User updated"}
 
 
@@ -562,10 +899,17 @@ async def admin_delete_user(
             detail="Cannot delete your own account"
         )
     
-    result = await db.auth_users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted = await db.auth_users.find_one_and_delete(
+        {"id": user_id},
+        projection={"_id": 0, "email": 1, "created_at": 1, "joinedDate": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    # Keep cohort counters (and so the retention ratios) in step with the user base
+    await record_cohort_removal(deleted)
+    invalidation_bus.publish("principal", user_id)
+    invalidation_bus.publish("analytics", "users")
     return {"success": True, "message": "User deleted"}
 
 
@@ -586,8 +930,196 @@ async def admin_reset_user_password(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await revoke_user_tokens(user_id)
     return {"success": True, "message": "Password reset successfully"}
 
+
+# ============= BULK USER IMPORT =============
+
+USER_IMPORT_MAX_BYTES = int(float(os.environ.get("USER_IMPORT_MAX_MB", "20")) * 1024 * 1024)
+USER_IMPORT_CHUNK = 500
+
+# bcrypt is deliberately slow; spread it over CPU cores outside the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+password_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+
+
+def parse_user_import(contents: bytes, ndjson: bool) -> List[dict]:
+    """Rows from a CSV (with a header row) or NDJSON upload"""
+    text = contents.decode("utf-8-sig")
+    if ndjson:
+        rows = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if line.strip():
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append({"__error__": f"Line {number}: invalid JSON"})
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+async def hash_passwords_parallel(passwords: List[str]) -> List[str]:
+    loop = asyncio.get_running_loop()
+    size = max(1, -(-len(passwords) // PASSWORD_HASH_WORKERS))
+    batches = await asyncio.gather(*[
+        loop.run_in_executor(password_pool, hash_passwords, passwords[i:i + size])
+        for i in range(0, len(passwords), size)
+    ])
+    return [hashed for batch in batches for hashed in batch]
+
+
+async def run_user_import(job_id: str, rows: List[dict], admin_id: str):
+    """Validate, hash and insert imported users in chunks, publishing progress as it goes"""
+    job = {
+        "id": job_id, "status": "running", "total": len(rows), "processed": 0,
+        "inserted": 0, "existing": 0, "duplicates": 0, "invalid": 0, "errors": []
+    }
+    
+    def note_error(row_number: int, message: str):
+        job["invalid"] += 1
+        if len(job["errors"]) < 50:
+            job["errors"].append({"row": row_number, "message": message})
+    
+    async def save(event: str):
+        await db.user_import_jobs.update_one({"id": job_id}, {"$set": job})
+        event_bus.publish(f"import:{job_id}", event, {k: v for k, v in job.items() if k != "errors"})
+    
+    seen = set()
+    try:
+        for start in range(0, len(rows), USER_IMPORT_CHUNK):
+            valid = []
+            for offset, row in enumerate(rows[start:start + USER_IMPORT_CHUNK]):
+                row_number = start + offset + 1
+                if "__error__" in row:
+                    note_error(row_number, row["__error__"])
+                    continue
+                try:
+                    user = AdminCreateUserModel(**{k: v for k, v in row.items() if v not in (None, "")})
+                except ValidationError as e:
+                    note_error(row_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                    continue
+                if user.email.lower() in seen:
+                    job["duplicates"] += 1
+                    continue
+                seen.add(user.email.lower())
+                valid.append(user)
+            
+            # Skip accounts that already exist; the unique email_lower index turns any
+            # race with a concurrent import or registration into a duplicate-key error
+            emails = [user.email.lower() for user in valid]
+            existing = {
+                doc["email_lower"] async for doc in db.auth_users.find(
+                    {"email_lower": {"$in": emails}}, {"_id": 0, "email_lower": 1}
+                )
+            }
+            job["existing"] += len(existing)
+            valid = [user for user in valid if user.email.lower() not in existing]
+            
+            if valid:
+                hashes = await hash_passwords_parallel([user.password for user in valid])
+                now = datetime.now(timezone.utc).isoformat()
+                report = await bulk_write_chunked(db.auth_users, [
+                    InsertOne({
+                        "id": str(uuid.uuid4()),
+                        "name": user.name,
+                        "email": user.email,
+                        **user_search_fields(user.name, user.email),
+                        "hashed_password": hashed,
+                        "role": user.role,
+                        "membershipLevel": user.membershipLevel,
+                        "joinedDate": now,
+                        "created_at": now,
+                        "is_active": True,
+                        "created_by": admin_id
+                    })
+                    for user, hashed in zip(valid, hashes)
+                ])
+                job["inserted"] += report["inserted"]
+                job["existing"] += report["duplicates"]
+                if report["inserted"]:
+                    await record_cohort_signup(now, report["inserted"])
+                    invalidation_bus.publish("analytics", "users")
+            
+            job["processed"] = min(start + USER_IMPORT_CHUNK, len(rows))
+            await save("import.progress")
+        job["status"] = "completed"
+    except Exception as e:
+        logger.error(f"User import {job_id} failed: {str(e)}")
+        job["status"] = "failed"
+        job["errors"].append({"row": None, "message": str(e)})
+    job["finished_at"] = datetime.now(timezone.utc).isoformat()
+    await save("import.finished")
+
+
+@api_router.post("/admin/users/import")
+async def admin_import_users(
+    file: UploadFile = File(...),
+    current_admin: dict = Depends(get_current_admin_user)
+):
+    """Start a bulk user import from CSV (name,email,password,role,membershipLevel) or NDJSON (admin only)"""
+    contents = await file.read(USER_IMPORT_MAX_BYTES + 1)
+    if len(contents) > USER_IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=400, detail=f"File too large (max {USER_IMPORT_MAX_BYTES // (1024 * 1024)}MB)")
+    ndjson = (file.filename or "").lower().endswith((".ndjson", ".jsonl")) or "ndjson" in (file.content_type or "")
+    try:
+        rows = parse_user_import(contents, ndjson)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse file: {str(e)}")
+    if not rows:
+        raise HTTPException(status_code=400, detail="No rows to import")
+    
+    job_id = str(uuid.uuid4())
+    await db.user_import_jobs.insert_one({
+        "id": job_id,
+        "status": "queued",
+        "filename": file.filename,
+        "total": len(rows),
+        "processed": 0,
+        "created_by": current_admin["id"],
+        "started_at": datetime.now(timezone.utc).isoformat()
+    })
+    task = asyncio.create_task(run_user_import(job_id, rows, current_admin["id"]))
+    background_tasks.append(task)
+    task.add_done_callback(background_tasks.remove)
+    return {"success": True, "jobId": job_id, "total": len(rows)}
+
+
+@api_router.get("/admin/users/import/{job_id}")
+async def get_user_import(job_id: str, current_admin: dict = Depends(get_current_admin_user)):
+    """Progress and result of a bulk user import (admin only)"""
+    job = await db.user_import_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
+
+
+@api_router.get("/admin/users/import/{job_id}/stream")
+async def stream_user_import(
+    job_id: str,
+    token: Optional[str] = Query(default=None, description="For EventSource, which cannot send headers"),
+    header_token: Optional[str] = Depends(oauth2_scheme)
+):
+    """Live import.progress / import.finished events for an import running on this worker (admin only)"""
+    await get_current_admin_user(header_token or token)
+    # Events published after this point are replayed, so a job finishing mid-request is not missed
+    resume_from = str(event_bus.last_id)
+    job = await db.user_import_jobs.find_one({"id": job_id}, {"_id": 0, "errors": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
+    
+    async def progress():
+        # Current state first; later events carry cumulative counts, so nothing is lost
+        yield format_sse(event_bus.last_id, "import.progress", job)
+        if job["status"] in ("completed", "failed"):
+            return
+        async for frame in stream_events({f"import:{job_id}"}, resume_from):
+            yield frame
+            if "event: import.finished" in frame:
+                return
+    
+    return sse_response(progress())
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
@@ -628,14 +1160,29 @@ async def get_payment_config():
 async def process_payment(payment_request: PaymentRequest):
     """Process a payment using Square Payments API"""
     try:
+        # Cart checkouts must match the server-side quote (1 cent of client rounding allowed)
+        if payment_request.paymentType == "product":
+            quote = await price_cart([
+                QuoteItem(id=item.id, quantity=item.quantity) for item in payment_request.items
+            ])
+            if abs(quote["total"] - payment_request.amount) > 1:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Amount does not match current prices (expected {quote['total']} cents)"
+                )
+        
         # Generate idempotency key
         idempotency_key = str(uuid.uuid4())
         
         # Create order in database first
         order_id = str(uuid.uuid4())
+        catalog = await catalog_cache.get()
         order_doc = {
             "id": order_id,
-            "items": [item.model_dump() for item in payment_request.items],
+            "items": [
+                {**item.model_dump(), "productId": item.productId if item.productId in catalog else catalog_item_id(item.id, catalog)}
+                for item in payment_request.items
+            ],
             "total_amount": payment_request.amount,
             "currency": payment_request.currency,
             "payment_type": payment_request.paymentType,
@@ -645,6 +1192,7 @@ async def process_payment(payment_request: PaymentRequest):
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.orders.insert_one(order_doc)
+        await record_order_status_change(order_doc, None, "pending")
         
         # Process payment with Square
         result = square_client.payments.create(
@@ -661,16 +1209,18 @@ async def process_payment(payment_request: PaymentRequest):
         
         if result.payment:
             # Update order with payment info
+            order_status = result.payment.status.lower() if result.payment.status else "completed"
             await db.orders.update_one(
                 {"id": order_id},
                 {
                     "$set": {
                         "square_payment_id": result.payment.id,
-                        "status": result.payment.status.lower() if result.payment.status else "completed",
+                        "status": order_status,
                         "updated_at": datetime.now(timezone.utc).isoformat()
                     }
                 }
             )
+            await record_order_status_change(order_doc, "pending", order_status)
             
             # Store payment record
             payment_doc = {
@@ -712,6 +1262,7 @@ async def process_payment(payment_request: PaymentRequest):
                 {"id": order_id},
                 {"$set": {"status": "failed"}}
             )
+            await record_order_status_change(order_doc, "pending", "failed")
             error_detail = result.errors[0].detail if result.errors else "Payment processing failed"
             raise HTTPException(status_code=400, detail=error_detail)
         
@@ -915,25 +1466,65 @@ async def get_email_logs():
     return logs
 
 
+# Operations per bulk_write round-trip
+BULK_WRITE_CHUNK = 1000
+
+
+async def bulk_write_chunked(collection, operations: list, chunk_size: int = BULK_WRITE_CHUNK) -> dict:
+    """Run unordered bulk_writes in chunks; one bad document never stops the rest"""
+    report = {"inserted": 0, "upserted": 0, "matched": 0, "modified": 0, "failed": 0, "duplicates": 0, "errors": []}
+    for start in range(0, len(operations), chunk_size):
+        chunk = operations[start:start + chunk_size]
+        try:
+            result = (await collection.bulk_write(chunk, ordered=False)).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            report["failed"] += len(result.get("writeErrors", []))
+            report["duplicates"] += sum(1 for error in result.get("writeErrors", []) if error.get("code") == 11000)
+            report["errors"].extend(
+                {"index": start + error["index"], "message": error.get("errmsg", "")}
+                for error in result.get("writeErrors", [])[:10 - len(report["errors"])]
+            )
+        report["inserted"] += result.get("nInserted", 0)
+        report["upserted"] += result.get("nUpserted", 0)
+        report["matched"] += result.get("nMatched", 0)
+        report["modified"] += result.get("nModified", 0)
+    return report
+
+
 @api_router.post("/users/sync")
 async def sync_users(users: List[UserModel]):
     """Sync users from frontend localStorage to backend"""
     try:
-        for user in users:
-            # Upsert user
-            await db.users.update_one(
+        # Later entries win when the same email appears more than once
+        latest = {user.email: user for user in users}
+        now = datetime.now(timezone.utc).isoformat()
+        operations = [
+            UpdateOne(
                 {"email": user.email},
                 {"$set": {
                     "id": user.id,
                     "name": user.name,
                     "email": user.email,
                     "joinedDate": user.joinedDate,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "updated_at": now
                 }},
                 upsert=True
             )
+            for user in latest.values()
+        ]
+        report = await bulk_write_chunked(db.users, operations)
         
-        return {"success": True, "message": f"Synced {len(users)} users"}
+        return {
+            "success": report["failed"] == 0,
+            "message": f"Synced {len(latest) - report['failed']} users",
+            "received": len(users),
+            "duplicates": len(users) - len(latest),
+            "inserted": report["upserted"],
+            "modified": report["modified"],
+            "failed": report["failed"],
+            "errors": report["errors"]
+        }
     except Exception as e:
         logger.error(f"User sync failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"User sync failed: {str(e)}")
@@ -1076,6 +1667,7 @@ async def create_product(product: ProductModel):
     await db.products.insert_one(product_dict)
     # Return without _id
     response_product = {k: v for k, v in product_dict.items() if k != "_id"}
+    invalidation_bus.publish("catalog")
     return {"success": True, "id": product_dict["id"], "product": response_product}
 
 @api_router.put("/products/{product_id}")
@@ -1088,6 +1680,7 @@ async def update_product(product_id: str, product: ProductModel):
     result = await db.products.update_one({"id": product_id}, {"$set": product_dict})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Product updated"}
 
 @api_router.delete("/products/{product_id}")
@@ -1096,9 +1689,67 @@ async def delete_product(product_id: str):
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Product deleted"}
 
 
+# ============= PRODUCT RECOMMENDATIONS =============
+recommender = CoPurchaseIndex(top_k=int(os.environ.get("RECOMMENDATIONS_TOP_K", "10")))
+
+
+def order_basket(order: dict, catalog: Optional[dict] = None) -> List[str]:
+    """Distinct catalog ids in an order, with size/flavor variants mapped to their product"""
+    return list({sales_product_id(item, catalog) for item in order.get("items", []) if item.get("id")})
+
+
+recommendations_rebuild_lock = asyncio.Lock()
+
+
+async def rebuild_recommendations() -> int:
+    """Rebuild the co-purchase index from all completed orders"""
+    async with recommendations_rebuild_lock:
+        # Orders completed from here on are replayed into the new index unless the query saw them
+        recommender.begin_rebuild()
+        baskets, order_ids = [], set()
+        catalog = await catalog_cache.get()
+        async for order in db.orders.find({"status": "completed"}, {"_id": 0, "id": 1, "items.id": 1, "items.productId": 1}):
+            baskets.append(order_basket(order, catalog))
+            order_ids.add(order.get("id"))
+        await asyncio.to_thread(recommender.rebuild, baskets, order_ids)
+    logger.info(f"Recommendations rebuilt from {len(baskets)} orders")
+    return len(recommender.rows)
+
+
+@api_router.get("/products/{product_id}/related")
+async def get_related_products(
+    product_id: str,
+    limit: int = Query(default=4, ge=1, le=50),
+    expand: bool = False
+):
+    """Products most often bought together with this one"""
+    related = recommender.related(product_id, limit if not expand else recommender.top_k)
+    if not expand:
+        return [{"id": related_id, "count": count} for related_id, count in related]
+    
+    # Hidden or deleted products are dropped, so over-fetch from the top-K row
+    products = await db.products.find(
+        {"id": {"$in": [related_id for related_id, _ in related]}, "isHidden": {"$ne": True}},
+        {"_id": 0}
+    ).to_list(None)
+    by_id = {product["id"]: product for product in products}
+    return [
+        {**by_id[related_id], "count": count}
+        for related_id, count in related if related_id in by_id
+    ][:limit]
+
+
+@api_router.post("/admin/recommendations/rebuild")
+async def rebuild_recommendations_endpoint(current_admin: dict = Depends(get_current_admin_user)):
+    """Rebuild the frequently-bought-together index from the order history (admin only)"""
+    products = await rebuild_recommendations()
+    return {"success": True, "message": f"Recommendations rebuilt: {products} products", "orders": recommender.orders}
+
+
 # ============= SERVICES API =============
 @api_router.get("/services")
 async def get_services(include_hidden: bool = False):
@@ -1114,6 +1765,7 @@ async def create_service(service: ServiceModel):
     service_dict["id"] = str(uuid.uuid4()) if not service_dict.get("id") else service_dict["id"]
     service_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     await db.services.insert_one(service_dict)
+    invalidation_bus.publish("catalog")
     return {"success": True, "id": service_dict["id"], "service": {k: v for k, v in service_dict.items() if k != "_id"}}
 
 @api_router.put("/services/{service_id}")
@@ -1126,6 +1778,7 @@ async def update_service(service_id: str, service: ServiceModel):
     result = await db.services.update_one({"id": service_id}, {"$set": service_dict})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Service updated"}
 
 @api_router.delete("/services/{service_id}")
@@ -1134,6 +1787,7 @@ async def delete_service(service_id: str):
     result = await db.services.delete_one({"id": service_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Service deleted"}
 
 
@@ -1152,6 +1806,7 @@ async def create_class(class_item: ClassModel):
     class_dict["id"] = str(uuid.uuid4()) if not class_dict.get("id") else class_dict["id"]
     class_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     await db.classes.insert_one(class_dict)
+    invalidation_bus.publish("catalog")
     return {"success": True, "id": class_dict["id"], "class": {k: v for k, v in class_dict.items() if k != "_id"}}
 
 @api_router.put("/classes/{class_id}")
@@ -1164,6 +1819,7 @@ async def update_class(class_id: str, class_item: ClassModel):
     result = await db.classes.update_one({"id": class_id}, {"$set": class_dict})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Class not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Class updated"}
 
 @api_router.delete("/classes/{class_id}")
@@ -1172,6 +1828,7 @@ async def delete_class(class_id: str):
     result = await db.classes.delete_one({"id": class_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Class not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Class deleted"}
 
 
@@ -1197,6 +1854,7 @@ async def create_retreat(retreat: RetreatModel):
         {"id": "50-50", "label": "50/50 Split", "amount": price / 2, "description": "Pay half now, half later"}
     ]
     await db.retreats.insert_one(retreat_dict)
+    invalidation_bus.publish("catalog")
     return {"success": True, "id": retreat_dict["id"], "retreat": {k: v for k, v in retreat_dict.items() if k != "_id"}}
 
 @api_router.put("/retreats/{retreat_id}")
@@ -1216,6 +1874,7 @@ async def update_retreat(retreat_id: str, retreat: RetreatModel):
     result = await db.retreats.update_one({"id": retreat_id}, {"$set": retreat_dict})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Retreat not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Retreat updated"}
 
 @api_router.delete("/retreats/{retreat_id}")
@@ -1224,6 +1883,7 @@ async def delete_retreat(retreat_id: str):
     result = await db.retreats.delete_one({"id": retreat_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Retreat not found")
+    invalidation_bus.publish("catalog")
     return {"success": True, "message": "Retreat deleted"}
 
 
@@ -1253,6 +1913,7 @@ async def create_fundraiser(fundraiser: FundraiserModel):
     if not fundraiser_dict.get("createdDate"):
         fundraiser_dict["createdDate"] = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     await db.fundraisers.insert_one(fundraiser_dict)
+    invalidation_bus.publish("analytics", "fundraisers")
     return {"success": True, "id": fundraiser_dict["id"], "fundraiser": {k: v for k, v in fundraiser_dict.items() if k != "_id"}}
 
 @api_router.put("/fundraisers/{fundraiser_id}")
@@ -1265,6 +1926,7 @@ async def update_fundraiser(fundraiser_id: str, fundraiser: FundraiserModel):
     result = await db.fundraisers.update_one({"id": fundraiser_id}, {"$set": fundraiser_dict})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Fundraiser not found")
+    invalidation_bus.publish("analytics", "fundraisers")
     return {"success": True, "message": "Fundraiser updated"}
 
 @api_router.patch("/fundraisers/{fundraiser_id}/status")
@@ -1276,6 +1938,7 @@ async def update_fundraiser_status(fundraiser_id: str, status: str):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Fundraiser not found")
+    invalidation_bus.publish("analytics", "fundraisers")
     return {"success": True, "message": f"Fundraiser status updated to {status}"}
 
 @api_router.delete("/fundraisers/{fundraiser_id}")
@@ -1284,6 +1947,7 @@ async def delete_fundraiser(fundraiser_id: str):
     result = await db.fundraisers.delete_one({"id": fundraiser_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Fundraiser not found")
+    invalidation_bus.publish("analytics", "fundraisers")
     return {"success": True, "message": "Fundraiser deleted"}
 
 
@@ -1301,6 +1965,7 @@ async def create_appointment(appointment: AppointmentModel):
     appointment_dict["id"] = str(uuid.uuid4()) if not appointment_dict.get("id") else appointment_dict["id"]
     appointment_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     await db.appointments.insert_one(appointment_dict)
+    invalidation_bus.publish("analytics", "appointments")
     return {"success": True, "id": appointment_dict["id"], "appointment": {k: v for k, v in appointment_dict.items() if k != "_id"}}
 
 @api_router.patch("/appointments/{appointment_id}/status")
@@ -1312,6 +1977,7 @@ async def update_appointment_status(appointment_id: str, status: str):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    invalidation_bus.publish("analytics", "appointments")
     return {"success": True, "message": f"Appointment status updated to {status}"}
 
 @api_router.delete("/appointments/{appointment_id}")
@@ -1320,6 +1986,7 @@ async def delete_appointment(appointment_id: str):
     result = await db.appointments.delete_one({"id": appointment_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    invalidation_bus.publish("analytics", "appointments")
     return {"success": True, "message": "Appointment deleted"}
 
 
@@ -1350,125 +2017,625 @@ async def delete_category(name: str):
 
 # ============= IMAGE UPLOAD API (GridFS) =============
 
+MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+MULTIPART_OVERHEAD = 64 * 1024  # Room for boundaries and part headers around the file
+UPLOAD_CHUNK_SIZE = 255 * 1024  # Matches the GridFS chunk size
+
+# Magic byte signatures of the accepted image types
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+IMAGE_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect the image type from the first bytes of a file"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+async def scan_upload(file: UploadFile) -> tuple:
+    """Hash, size-check and sniff an upload one chunk at a time.
+    
+    Returns (sha256 hex digest, size, detected content type).
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    content_type = None
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if content_type is None:
+            content_type = sniff_image_type(chunk)
+            if content_type is None:
+                raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPEG, PNG, GIF, WEBP")
+        size += len(chunk)
+        if size > MAX_IMAGE_SIZE:
+            raise HTTPException(status_code=400, detail="File too large. Max size: 5MB")
+        sha256.update(chunk)
+    if content_type is None:
+        raise HTTPException(status_code=400, detail="Empty file")
+    return sha256.hexdigest(), size, content_type
+
+
+async def limited_body(request: Request, limit: int):
+    """Yield the raw request body, failing as soon as it exceeds limit bytes"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=400, detail="File too large. Max size: 5MB")
+        yield chunk
+
+
+async def read_upload_form(request: Request) -> UploadFile:
+    """Parse a multipart upload while enforcing the size cap on the wire.
+    
+    Declaring the file as a File(...) parameter would let Starlette spool the
+    whole body to disk before the handler could look at its size.
+    """
+    limit = MAX_IMAGE_SIZE + MULTIPART_OVERHEAD
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=400, detail="File too large. Max size: 5MB")
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    try:
+        form = await MultiPartParser(request.headers, limited_body(request, limit), max_files=1, max_fields=10).parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    file = form.get("file")
+    if not isinstance(file, StarletteUploadFile):
+        raise HTTPException(status_code=400, detail="Missing file")
+    return file
+
+
 @api_router.post("/upload/image")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload an image file and return its URL"""
-    # Validate file type
+async def upload_image(request: Request):
+    """Upload an image file (multipart field "file") and return its URL"""
+    file = await read_upload_form(request)
+    try:
+        return await store_upload(file)
+    finally:
+        await file.close()
+
+
+async def store_upload(file: UploadFile) -> dict:
+    """Validate an uploaded file and store it in GridFS, deduplicated by hash"""
+    # Validate declared file type
     allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPEG, PNG, GIF, WEBP")
     
-    # Validate file size (max 5MB)
-    contents = await file.read()
-    if len(contents) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max size: 5MB")
+    # Validate size and actual type without holding the file in memory
+    digest, size, content_type = await scan_upload(file)
+    
+    # Content-addressed: identical uploads share one GridFS file
+    existing = await claim_image_reference(digest)
+    if existing:
+        return existing
     
-    # Generate unique filename
-    file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    file_id = str(uuid.uuid4())
-    filename = f"{file_id}.{file_ext}"
+    filename = f"{digest}.{IMAGE_EXTENSIONS[content_type]}"
     
-    # Store in GridFS
-    await fs_bucket.upload_from_stream(
+    # Stream into GridFS chunk by chunk
+    await file.seek(0)
+    grid_in = fs_bucket.open_upload_stream_with_id(
+        ObjectId(),
         filename,
-        io.BytesIO(contents),
+        chunk_size_bytes=UPLOAD_CHUNK_SIZE,
         metadata={
-            "content_type": file.content_type,
+            "content_type": content_type,
             "original_filename": file.filename,
+            "sha256": digest,
+            "ref_count": 1,
             "uploaded_at": datetime.now(timezone.utc).isoformat()
         }
     )
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await grid_in.write(chunk)
+        await grid_in.close()
+    except DuplicateKeyError:
+        # A concurrent upload of the same bytes won the race; drop our partial file
+        await grid_in.abort()
+        existing = await claim_image_reference(digest)
+        if existing:
+            return existing
+        raise HTTPException(status_code=500, detail="Failed to store image")
+    except Exception as e:
+        await grid_in.abort()
+        logger.error(f"Image upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to store image")
     
-    # Return the URL to access the image
-    image_url = f"/api/images/{filename}"
-    
+    return image_upload_response(filename, size, content_type)
+
+
+def image_upload_response(filename: str, size: int, content_type: str, duplicate: bool = False) -> dict:
     return {
         "success": True,
         "filename": filename,
-        "url": image_url,
-        "size": len(contents),
-        "content_type": file.content_type
+        "url": f"/api/images/{filename}",
+        "size": size,
+        "content_type": content_type,
+        "duplicate": duplicate
     }
 
 
+async def claim_image_reference(digest: str) -> Optional[dict]:
+    """Take a reference on an already stored image with this hash, if any"""
+    existing = await db["uploads.files"].find_one_and_update(
+        {"metadata.sha256": digest},
+        {
+            "$inc": {"metadata.ref_count": 1},
+            "$set": {"metadata.claimed_at": datetime.now(timezone.utc).isoformat()}
+        }
+    )
+    if not existing:
+        return None
+    return image_upload_response(
+        existing["filename"],
+        existing["length"],
+        existing["metadata"].get("content_type", "image/jpeg"),
+        duplicate=True
+    )
+
+
+# Responsive variants are rendered on first request and cached back into GridFS
+IMAGE_VARIANT_WIDTHS = [200, 400, 800, 1200]
+IMAGE_VARIANT_FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+if pil_features.check("avif"):
+    IMAGE_VARIANT_FORMATS["avif"] = "image/avif"
+
+# Resizing/encoding is CPU bound, keep it off the event loop
+image_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("IMAGE_WORKERS", "2")),
+    thread_name_prefix="image-variants"
+)
+image_variant_locks: Dict[str, asyncio.Lock] = {}
+
+
+def render_image_variant(contents: bytes, width: int, image_format: str) -> bytes:
+    """Resize an image to the given width (never upscaling) and re-encode it"""
+    with Image.open(io.BytesIO(contents)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+        if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format=image_format.upper(), quality=80, optimize=True)
+        return output.getvalue()
+
+
+def get_variant_filename(filename: str, width: int, image_format: str) -> str:
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}_w{width}.{image_format}"
+
+
+def pick_variant_format(fmt: Optional[str], accept: str) -> Optional[str]:
+    """Choose the variant encoding from an explicit ?fmt= or the Accept header.
+    
+    Returns None when the client has no preference (the original's type is kept).
+    """
+    if fmt:
+        fmt = "jpeg" if fmt.lower() == "jpg" else fmt.lower()
+        if fmt not in IMAGE_VARIANT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid format. Allowed: {', '.join(IMAGE_VARIANT_FORMATS)}"
+            )
+        return fmt
+    if "avif" in IMAGE_VARIANT_FORMATS and "image/avif" in accept:
+        return "avif"
+    if "image/webp" in accept:
+        return "webp"
+    return None
+
+
+class ImageCache:
+    """Byte-budgeted LRU cache of hot image responses.
+    
+    Entries are only admitted once they have been requested `min_hits` times,
+    so one-off requests cannot flush the hot set.
+    """
+    
+    def __init__(self, max_bytes: int, min_hits: int = 2, max_tracked: int = 10000):
+        self.max_bytes = max_bytes
+        self.min_hits = min_hits
+        self.max_tracked = max_tracked
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.frequency: Dict[tuple, int] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+    
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+    
+    def put(self, key: tuple, contents: bytes, content_type: str, headers: dict):
+        # Admission: count requests, halving all counts when the table fills up
+        self.frequency[key] = self.frequency.get(key, 0) + 1
+        if len(self.frequency) > self.max_tracked:
+            self.frequency = {k: v // 2 for k, v in self.frequency.items() if v > 1}
+        if self.frequency.get(key, 0) < self.min_hits or len(contents) > self.max_bytes // 4:
+            self.rejections += 1
+            return
+        
+        self.discard(key)
+        self.entries[key] = (contents, content_type, headers)
+        self.size += len(contents)
+        while self.size > self.max_bytes:
+            _, (evicted, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+    
+    def discard(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+    
+    def invalidate(self, filename: str):
+        """Drop the original and every variant of an image"""
+        for key in [k for k in self.entries if k[0] == filename]:
+            self.discard(key)
+        for key in [k for k in self.frequency if k[0] == filename]:
+            del self.frequency[key]
+    
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / requests, 4) if requests else 0,
+            "evictions": self.evictions,
+            "rejectedAdmissions": self.rejections
+        }
+
+
+image_cache = ImageCache(
+    max_bytes=int(float(os.environ.get("IMAGE_CACHE_MB", "64")) * 1024 * 1024),
+    min_hits=int(os.environ.get("IMAGE_CACHE_MIN_HITS", "2"))
+)
+invalidation_bus.register("image", image_cache.invalidate)
+
+
+async def get_image_variant(filename: str, width: int, image_format: str) -> tuple:
+    """Return (contents, content_type) of a variant, rendering and caching it on a miss"""
+    variant_name = get_variant_filename(filename, width, image_format)
+    lock = image_variant_locks.setdefault(variant_name, asyncio.Lock())
+    try:
+        async with lock:
+            try:
+                grid_out = await fs_bucket.open_download_stream_by_name(variant_name)
+                return await grid_out.read(), IMAGE_VARIANT_FORMATS[image_format]
+            except NoFile:
+                pass
+            
+            grid_out = await fs_bucket.open_download_stream_by_name(filename)
+            original = await grid_out.read()
+            loop = asyncio.get_running_loop()
+            contents = await loop.run_in_executor(
+                image_executor, render_image_variant, original, width, image_format
+            )
+            await fs_bucket.upload_from_stream(
+                variant_name,
+                io.BytesIO(contents),
+                metadata={
+                    "content_type": IMAGE_VARIANT_FORMATS[image_format],
+                    "variant_of": filename,
+                    "width": width,
+                    "uploaded_at": datetime.now(timezone.utc).isoformat()
+                }
+            )
+    finally:
+        image_variant_locks.pop(variant_name, None)
+    return contents, IMAGE_VARIANT_FORMATS[image_format]
+
+
 @api_router.get("/images/{filename}")
-async def get_image(filename: str):
-    """Retrieve an uploaded image"""
+async def get_image(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, gt=0),
+    fmt: Optional[str] = None
+):
+    """Retrieve an uploaded image, optionally as a resized variant (?w=400&fmt=webp)"""
+    width = None
+    requested_format = None
+    if w is not None or fmt is not None:
+        # Snap to the next configured width so the number of cached variants stays bounded
+        width = IMAGE_VARIANT_WIDTHS[-1]
+        if w is not None:
+            width = next((size for size in IMAGE_VARIANT_WIDTHS if size >= w), width)
+        requested_format = pick_variant_format(fmt, request.headers.get("accept", ""))
+    
+    cache_key = (filename, width, requested_format)
+    cached = image_cache.get(cache_key)
+    if cached:
+        contents, content_type, headers = cached
+        return StreamingResponse(io.BytesIO(contents), media_type=content_type, headers=headers)
+    
     try:
         grid_out = await fs_bucket.open_download_stream_by_name(filename)
-        contents = await grid_out.read()
-        content_type = grid_out.metadata.get("content_type", "image/jpeg") if grid_out.metadata else "image/jpeg"
-        
-        return StreamingResponse(
-            io.BytesIO(contents),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=31536000"}
-        )
-    except Exception:
+    except NoFile:
         raise HTTPException(status_code=404, detail="Image not found")
+    content_type = grid_out.metadata.get("content_type", "image/jpeg") if grid_out.metadata else "image/jpeg"
+    headers = {"Cache-Control": "public, max-age=31536000"}
+    
+    # Animated GIFs are served as-is
+    if width is None or content_type == "image/gif":
+        contents = await grid_out.read()
+    else:
+        image_format = requested_format or ("png" if content_type == "image/png" else "jpeg")
+        try:
+            contents, content_type = await get_image_variant(filename, width, image_format)
+        except Exception as e:
+            logger.error(f"Failed to render variant of {filename}: {str(e)}")
+            raise HTTPException(status_code=422, detail="Could not process image")
+        if fmt is None:
+            headers["Vary"] = "Accept"
+    
+    image_cache.put(cache_key, contents, content_type, headers)
+    return StreamingResponse(
+        io.BytesIO(contents),
+        media_type=content_type,
+        headers=headers
+    )
+
+
+@api_router.get("/admin/image-cache")
+async def get_image_cache_stats(current_admin: dict = Depends(get_current_admin_user)):
+    """Hot image cache metrics (admin only)"""
+    return image_cache.stats()
+
+
+@api_router.get("/admin/cache-bus")
+async def get_cache_bus_stats(current_admin: dict = Depends(get_current_admin_user)):
+    """Cross-worker invalidation metrics for the worker serving this request (admin only)"""
+    return invalidation_bus.stats()
 
 
 @api_router.delete("/images/{filename}")
 async def delete_image(filename: str):
-    """Delete an uploaded image"""
+    """Release a reference to an uploaded image; the last one deletes it and its cached variants"""
     try:
-        cursor = fs_bucket.find({"filename": filename})
-        async for grid_out in cursor:
-            await fs_bucket.delete(grid_out._id)
-            return {"success": True, "message": "Image deleted"}
-        raise HTTPException(status_code=404, detail="Image not found")
+        # A concurrent claim can bump the count between the two steps, so the
+        # delete only matches a file that still holds the last reference
+        for _ in range(5):
+            released = await db["uploads.files"].find_one_and_update(
+                {"filename": filename, "metadata.ref_count": {"$gt": 1}},
+                {"$inc": {"metadata.ref_count": -1}}
+            )
+            if released:
+                return {"success": True, "message": "Image reference released"}
+            
+            deleted = await db["uploads.files"].find_one_and_delete(
+                {"filename": filename, "metadata.ref_count": {"$not": {"$gt": 1}}},
+                projection={"_id": 1}
+            )
+            if deleted:
+                await db["uploads.chunks"].delete_many({"files_id": deleted["_id"]})
+                invalidation_bus.publish("image", filename)
+                async for variant in fs_bucket.find({"metadata.variant_of": filename}):
+                    await fs_bucket.delete(variant._id)
+                return {"success": True, "message": "Image deleted"}
+            
+            if not await db["uploads.files"].find_one({"filename": filename}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Image not found")
+        raise HTTPException(status_code=409, detail="Image is being modified, please retry")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# ============= EMERGENCY REQUESTS API =============
+# ============= IMAGE GARBAGE COLLECTION =============
 
-class EmergencyRequestModel(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: Optional[str] = None
-    name: str
-    phone: str = ""
-    email: str = ""
-    crisisType: str
-    urgency: str = "medium"
-    description: str
-    status: str = "pending"
-    submittedAt: Optional[str] = None
-    resolvedAt: Optional[str] = None
+IMAGE_URL_PATTERN = re.compile(r"/api/images/([^/?#\s\"']+)")
 
+# (collection, field) pairs that may hold /api/images/... URLs
+IMAGE_REFERENCE_FIELDS = [
+    ("products", "image"),
+    ("services", "image"),
+    ("classes", "image"),
+    ("retreats", "image"),
+    ("fundraisers", "image"),
+    ("community_posts", "image"),
+    ("auth_users", "profileImage"),
+]
 
-@api_router.get("/emergency-requests")
-async def get_emergency_requests():
-    """Get all emergency requests"""
-    requests = await db.emergency_requests.find({}, {"_id": 0}).to_list(1000)
-    return requests
 
+async def collect_image_references() -> set:
+    """Stream every stored image URL and return the set of referenced filenames"""
+    referenced = set()
+    for collection, field in IMAGE_REFERENCE_FIELDS:
+        cursor = db[collection].find({field: {"$regex": "/api/images/"}}, {"_id": 0, field: 1})
+        async for doc in cursor:
+            referenced.update(IMAGE_URL_PATTERN.findall(doc.get(field) or ""))
+    return referenced
 
-@api_router.post("/emergency-requests")
-async def create_emergency_request(request: EmergencyRequestModel):
-    """Create a new emergency request"""
-    request_dict = request.model_dump()
+
+async def delete_image_files(filenames: List[str]):
+    """Delete originals and their variants in one round-trip per collection"""
+    ids = [f["_id"] async for f in db["uploads.files"].find(
+        {"$or": [{"filename": {"$in": filenames}}, {"metadata.variant_of": {"$in": filenames}}]},
+        {"_id": 1}
+    )]
+    await db["uploads.files"].delete_many({"_id": {"$in": ids}})
+    await db["uploads.chunks"].delete_many({"files_id": {"$in": ids}})
+    for filename in filenames:
+        invalidation_bus.publish("image", filename)
+
+
+async def collect_orphaned_images(grace_hours: float = 24, dry_run: bool = True, batch_size: int = 500) -> dict:
+    """Find (and unless dry_run, delete) uploads no document references.
+    
+    Files uploaded or re-claimed within the grace period are kept so that
+    images uploaded for a form that has not been saved yet survive.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+    referenced = await collect_image_references()
+    
+    cursor = db["uploads.files"].find(
+        {
+            "metadata.variant_of": {"$exists": False},
+            "uploadDate": {"$lt": cutoff},
+            "$or": [
+                {"metadata.claimed_at": {"$exists": False}},
+                {"metadata.claimed_at": {"$lt": cutoff.isoformat()}}
+            ]
+        },
+        {"filename": 1, "length": 1}
+    )
+    
+    orphans = []
+    orphan_count = 0
+    orphan_bytes = 0
+    batch = []
+    async for grid_file in cursor:
+        if grid_file["filename"] in referenced:
+            continue
+        orphan_count += 1
+        orphan_bytes += grid_file.get("length", 0)
+        if len(orphans) < 100:
+            orphans.append(grid_file["filename"])
+        if not dry_run:
+            batch.append(grid_file["filename"])
+            if len(batch) >= batch_size:
+                await delete_image_files(batch)
+                batch = []
+    if batch:
+        await delete_image_files(batch)
+    
+    report = {
+        "dryRun": dry_run,
+        "graceHours": grace_hours,
+        "referencedImages": len(referenced),
+        "orphanedImages": orphan_count,
+        "orphanedBytes": orphan_bytes,
+        "sample": orphans
+    }
+    logger.info(f"Image GC {'dry run' if dry_run else 'run'}: {orphan_count} orphans, {orphan_bytes} bytes")
+    return report
+
+
+async def run_image_gc_periodically(interval_hours: float):
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await collect_orphaned_images(
+                grace_hours=float(os.environ.get("IMAGE_GC_GRACE_HOURS", "24")),
+                dry_run=False
+            )
+        except Exception as e:
+            logger.error(f"Image GC failed: {str(e)}")
+
+
+@api_router.post("/admin/images/gc")
+async def garbage_collect_images(
+    dry_run: bool = True,
+    grace_hours: float = Query(24, ge=0),
+    batch_size: int = Query(500, gt=0, le=5000),
+    current_admin: dict = Depends(get_current_admin_user)
+):
+    """Report (dry_run=true) or delete images no longer referenced anywhere (admin only)"""
+    return await collect_orphaned_images(grace_hours=grace_hours, dry_run=dry_run, batch_size=batch_size)
+
+
+# ============= EMERGENCY REQUESTS API =============
+
+class EmergencyRequestModel(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: Optional[str] = None
+    name: str
+    phone: str = ""
+    email: str = ""
+    crisisType: str
+    urgency: str = "medium"
+    description: str
+    status: str = "pending"
+    submittedAt: Optional[str] = None
+    resolvedAt: Optional[str] = None
+
+
+# Sort keys for triage; unknown urgencies sort with "medium"
+URGENCY_RANKS = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+
+def urgency_rank(urgency: Optional[str]) -> int:
+    return URGENCY_RANKS.get((urgency or "").lower(), URGENCY_RANKS["medium"])
+
+
+async def backfill_urgency_ranks():
+    """Stamp urgencyRank on requests created before it existed"""
+    missing = {"urgencyRank": {"$exists": False}}
+    if not await db.emergency_requests.find_one(missing):
+        return
+    for urgency, rank in URGENCY_RANKS.items():
+        await db.emergency_requests.update_many({**missing, "urgency": urgency}, {"$set": {"urgencyRank": rank}})
+    await db.emergency_requests.update_many(missing, {"$set": {"urgencyRank": URGENCY_RANKS["medium"]}})
+
+
+@api_router.get("/emergency-requests")
+async def get_emergency_requests(
+    status_filter: Optional[str] = Query(default=None, alias="status", description="e.g. pending"),
+    limit: int = Query(default=1000, ge=1, le=1000)
+):
+    """Get emergency requests, most urgent and longest waiting first"""
+    query = {"status": status_filter} if status_filter else {}
+    requests = await db.emergency_requests.find(
+        query, {"_id": 0, "urgencyRank": 0}
+    ).sort([("urgencyRank", 1), ("submittedAt", 1)]).limit(limit).to_list(limit)
+    return requests
+
+
+@api_router.post("/emergency-requests")
+async def create_emergency_request(request: EmergencyRequestModel):
+    """Create a new emergency request"""
+    request_dict = request.model_dump()
     request_dict["id"] = str(uuid.uuid4()) if not request_dict.get("id") else request_dict["id"]
     request_dict["submittedAt"] = datetime.now(timezone.utc).isoformat()
     request_dict["status"] = "pending"
+    request_dict["urgencyRank"] = urgency_rank(request_dict["urgency"])
     await db.emergency_requests.insert_one(request_dict)
-    return {"success": True, "id": request_dict["id"], "request": {k: v for k, v in request_dict.items() if k != "_id"}}
+    invalidation_bus.publish("analytics", "emergencies")
+    response_request = {k: v for k, v in request_dict.items() if k not in ("_id", "urgencyRank")}
+    event_bus.publish("emergency", "emergency.created", response_request)
+    return {"success": True, "id": request_dict["id"], "request": response_request}
 
 
 @api_router.patch("/emergency-requests/{request_id}/resolve")
 async def resolve_emergency_request(request_id: str):
     """Mark an emergency request as resolved"""
+    resolved_at = datetime.now(timezone.utc).isoformat()
     result = await db.emergency_requests.update_one(
         {"id": request_id},
         {"$set": {
             "status": "resolved",
-            "resolvedAt": datetime.now(timezone.utc).isoformat()
+            "resolvedAt": resolved_at
         }}
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Request not found")
+    invalidation_bus.publish("analytics", "emergencies")
+    event_bus.publish("emergency", "emergency.resolved", {"id": request_id, "resolvedAt": resolved_at})
     return {"success": True, "message": "Request marked as resolved"}
 
 
@@ -1478,9 +2645,126 @@ async def delete_emergency_request(request_id: str):
     result = await db.emergency_requests.delete_one({"id": request_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Request not found")
+    invalidation_bus.publish("analytics", "emergencies")
+    event_bus.publish("emergency", "emergency.deleted", {"id": request_id})
     return {"success": True, "message": "Request deleted"}
 
 
+# ============= LIVE EVENTS (SSE) =============
+
+class EventSubscriber:
+    def __init__(self, topics: set, queue_size: int):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class EventBus:
+    """In-process pub/sub for Server-Sent Events.
+    
+    Each subscriber gets a bounded queue; a client too slow to drain it is
+    dropped and resumes from the replay buffer via Last-Event-ID.
+    """
+    
+    def __init__(self, replay_size: int = 500, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.replay: deque = deque(maxlen=replay_size)
+        self.subscribers: List[EventSubscriber] = []
+        self.last_id = 0
+    
+    def publish(self, topic: str, event: str, data: dict):
+        self.last_id += 1
+        entry = (self.last_id, topic, event, data)
+        self.replay.append(entry)
+        for subscriber in list(self.subscribers):
+            if topic not in subscriber.topics:
+                continue
+            try:
+                subscriber.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+    
+    def subscribe(self, topics: set, last_event_id: Optional[int] = None) -> tuple:
+        """Register a subscriber; returns it with any replayed events and whether replay was complete"""
+        subscriber = EventSubscriber(topics, self.queue_size)
+        self.subscribers.append(subscriber)
+        if last_event_id is None:
+            return subscriber, [], True
+        oldest = self.replay[0][0] if self.replay else self.last_id + 1
+        # A gap before the buffer, or an id from before a restart, cannot be replayed
+        complete = oldest <= last_event_id + 1 and last_event_id <= self.last_id
+        backlog = [entry for entry in self.replay if entry[0] > last_event_id and entry[1] in topics]
+        return subscriber, backlog if complete else [], complete
+    
+    def unsubscribe(self, subscriber: EventSubscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+
+event_bus = EventBus(
+    replay_size=int(os.environ.get("SSE_REPLAY_SIZE", "500")),
+    queue_size=int(os.environ.get("SSE_QUEUE_SIZE", "100"))
+)
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+
+
+def format_sse(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_events(topics: set, last_event_id: Optional[str]):
+    """Yield SSE frames for the given topics until the client goes away"""
+    try:
+        resume_from = int(last_event_id) if last_event_id else None
+    except ValueError:
+        resume_from = None
+    subscriber, backlog, complete = event_bus.subscribe(topics, resume_from)
+    try:
+        yield "retry: 3000\n\n"
+        if not complete:
+            # Missed events are gone; tell the client to refetch its state
+            yield format_sse(event_bus.last_id, "reset", {})
+        for entry_id, _, event, data in backlog:
+            yield format_sse(entry_id, event, data)
+        while not subscriber.dropped:
+            try:
+                entry_id, _, event, data = await asyncio.wait_for(
+                    subscriber.queue.get(), timeout=SSE_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_sse(entry_id, event, data)
+    finally:
+        event_bus.unsubscribe(subscriber)
+
+
+def sse_response(generator) -> StreamingResponse:
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@api_router.get("/admin/emergency/stream")
+async def emergency_stream(
+    token: Optional[str] = Query(default=None, description="For EventSource, which cannot send headers"),
+    header_token: Optional[str] = Depends(oauth2_scheme),
+    last_event_id: Optional[str] = Header(default=None)
+):
+    """Live emergency events for admins: emergency.created, emergency.resolved, emergency.deleted"""
+    await get_current_admin_user(header_token or token)
+    return sse_response(stream_events({"emergency"}, last_event_id))
+
+
+@api_router.get("/community/stream")
+async def community_stream(last_event_id: Optional[str] = Header(default=None)):
+    """Live community events: post.created, post.deleted, comment.created, like.updated"""
+    return sse_response(stream_events({"community"}, last_event_id))
+
+
 # ============= COMMUNITY POSTS API =============
 
 class CommunityPostModel(BaseModel):
@@ -1495,11 +2779,182 @@ class CommunityPostModel(BaseModel):
     date: Optional[str] = None
 
 
+# Posts keep only their newest comments inline; the rest are paged from community_comments
+COMMENT_PREVIEW_SIZE = 3
+
+
+def encode_cursor(*values: str) -> str:
+    """Opaque keyset cursor for a sort position, e.g. (date, id)"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int = 2) -> list:
+    """Inverse of encode_cursor; malformed cursors are a client error"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not (isinstance(values, list) and len(values) == size and all(isinstance(v, str) for v in values)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def before_cursor(cursor: str) -> dict:
+    """Filter for documents after a cursor in (date desc, id desc) order"""
+    date, item_id = decode_cursor(cursor)
+    return {"$or": [{"date": {"$lt": date}}, {"date": date, "id": {"$lt": item_id}}]}
+
+
+# Namespace for ids derived from legacy comment contents
+LEGACY_COMMENT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "mothernatural/community-comments")
+
+
+def legacy_comment_id(post_id: str, position: int, comment: dict) -> str:
+    """Stable id for an embedded comment stored without one, so re-runs do not duplicate it"""
+    key = "|".join([post_id, str(position), str(comment.get("date", "")), str(comment.get("author", "")), str(comment.get("content", ""))])
+    return str(uuid.uuid5(LEGACY_COMMENT_NAMESPACE, key))
+
+
+async def migrate_post_comments(post: dict) -> bool:
+    """Move one post's embedded comments into community_comments.
+    
+    Idempotent: comments are upserted by id, and the count and preview are
+    read back from community_comments. Returns False if another worker
+    finished the post first.
+    """
+    comments = [
+        comment if comment.get("id") else {**comment, "id": legacy_comment_id(post["id"], position, comment)}
+        for position, comment in enumerate(post.get("comments") or [])
+    ]
+    if comments:
+        await db.community_comments.bulk_write([
+            UpdateOne(
+                {"id": comment["id"]},
+                {"$setOnInsert": {**comment, "postId": post["id"]}},
+                upsert=True
+            )
+            for comment in comments
+        ], ordered=False)
+    count = await db.community_comments.count_documents({"postId": post["id"]})
+    newest = await db.community_comments.find(
+        {"postId": post["id"]}, {"_id": 0, "postId": 0}
+    ).sort([("date", -1), ("id", -1)]).limit(COMMENT_PREVIEW_SIZE).to_list(COMMENT_PREVIEW_SIZE)
+    result = await db.community_posts.update_one(
+        {"id": post["id"], "commentsMigrated": {"$ne": True}},
+        {"$set": {"commentCount": count, "comments": newest[::-1], "commentsMigrated": True}}
+    )
+    return result.modified_count > 0
+
+
+async def migrate_embedded_comments(batch_size: int = 100) -> int:
+    """Move comments embedded in posts into community_comments; safe to re-run"""
+    migrated = 0
+    cursor = db.community_posts.find({"commentsMigrated": {"$ne": True}}, {"_id": 0, "id": 1, "comments": 1})
+    async for post in cursor:
+        if not await migrate_post_comments(post):
+            continue
+        migrated += 1
+        if migrated % batch_size == 0:
+            logger.info(f"Comment migration: {migrated} posts")
+    return migrated
+
+
+class LikeBuffer:
+    """In-memory like count deltas, written back to posts in batches.
+    
+    Every like still records a post_likes row, but the post's counter gets
+    one $inc per flush instead of one per like.
+    """
+    
+    def __init__(self):
+        self.deltas: Dict[str, int] = {}
+        self.likes = 0
+        self.writes = 0
+    
+    def add(self, post_id: str, delta: int):
+        self.deltas[post_id] = self.deltas.get(post_id, 0) + delta
+        self.likes += 1
+    
+    def pending(self, post_id: str) -> int:
+        return self.deltas.get(post_id, 0)
+    
+    def discard(self, post_id: str):
+        self.deltas.pop(post_id, None)
+    
+    async def flush(self) -> int:
+        # Swap before awaiting so likes arriving mid-flush land in the next batch
+        deltas, self.deltas = self.deltas, {}
+        batch = [(post_id, delta) for post_id, delta in deltas.items() if delta]
+        if not batch:
+            return 0
+        updates = [UpdateOne({"id": post_id}, {"$inc": {"likes": delta}}) for post_id, delta in batch]
+        try:
+            await db.community_posts.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: everything but the listed ops was applied, so only those are retried
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            self.requeue(batch[i] for i in sorted(failed))
+            self.writes += len(updates) - len(failed)
+            raise
+        except Exception:
+            # Unknown outcome (e.g. the connection dropped); retry the whole batch
+            self.requeue(batch)
+            raise
+        self.writes += len(updates)
+        return len(updates)
+    
+    def requeue(self, entries):
+        """Put deltas back so they are retried on the next flush"""
+        for post_id, delta in entries:
+            self.deltas[post_id] = self.deltas.get(post_id, 0) + delta
+
+
+like_buffer = LikeBuffer()
+
+
+async def flush_likes_periodically(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await like_buffer.flush()
+        except Exception as e:
+            logger.error(f"Like flush failed: {str(e)}")
+
+
+def with_pending_likes(post: dict) -> dict:
+    """Apply unflushed like deltas so counts are current on this worker"""
+    post["likes"] = post.get("likes", 0) + like_buffer.pending(post["id"])
+    return post
+
+
 @api_router.get("/community-posts")
 async def get_community_posts():
     """Get all community posts"""
     posts = await db.community_posts.find({}, {"_id": 0}).sort("date", -1).to_list(1000)
-    return posts
+    return [with_pending_likes(post) for post in posts]
+
+
+@api_router.get("/community-posts/feed")
+async def get_community_feed(
+    limit: int = Query(default=int(os.environ.get("FEED_PAGE_SIZE", "20")), ge=1, le=100),
+    cursor: Optional[str] = None,
+    authorId: Optional[str] = None
+):
+    """Newest-first page of community posts; pass nextCursor back for the next page"""
+    query = {}
+    if authorId:
+        query["authorId"] = authorId
+    if cursor:
+        query.update(before_cursor(cursor))
+    posts = await db.community_posts.find(
+        query, {"_id": 0}
+    ).sort([("date", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1]["date"], posts[-1]["id"])
+    return {"posts": [with_pending_likes(post) for post in posts], "nextCursor": next_cursor}
 
 
 @api_router.post("/community-posts")
@@ -1510,20 +2965,46 @@ async def create_community_post(post: CommunityPostModel):
     post_dict["date"] = datetime.now(timezone.utc).isoformat()
     post_dict["likes"] = 0
     post_dict["comments"] = []
+    post_dict["commentCount"] = 0
+    post_dict["commentsMigrated"] = True
     await db.community_posts.insert_one(post_dict)
-    return {"success": True, "id": post_dict["id"], "post": {k: v for k, v in post_dict.items() if k != "_id"}}
+    response_post = {k: v for k, v in post_dict.items() if k != "_id"}
+    event_bus.publish("community", "post.created", response_post)
+    return {"success": True, "id": post_dict["id"], "post": response_post}
 
 
 @api_router.post("/community-posts/{post_id}/like")
-async def like_community_post(post_id: str):
-    """Like a community post"""
-    result = await db.community_posts.update_one(
-        {"id": post_id},
-        {"$inc": {"likes": 1}}
-    )
-    if result.modified_count == 0:
+async def like_community_post(post_id: str, current_user: dict = Depends(get_current_active_user)):
+    """Like a community post (once per user)"""
+    post = await db.community_posts.find_one({"id": post_id}, {"_id": 0, "id": 1, "likes": 1})
+    if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    return {"success": True, "message": "Post liked"}
+    try:
+        await db.post_likes.insert_one({
+            "postId": post_id,
+            "userId": current_user["id"],
+            "date": datetime.now(timezone.utc).isoformat()
+        })
+        like_buffer.add(post_id, 1)
+    except DuplicateKeyError:
+        pass
+    likes = with_pending_likes(post)["likes"]
+    event_bus.publish("community", "like.updated", {"postId": post_id, "likes": likes})
+    return {"success": True, "liked": True, "likes": likes}
+
+
+@api_router.delete("/community-posts/{post_id}/like")
+async def unlike_community_post(post_id: str, current_user: dict = Depends(get_current_active_user)):
+    """Remove the current user's like from a post"""
+    post = await db.community_posts.find_one({"id": post_id}, {"_id": 0, "id": 1, "likes": 1})
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    result = await db.post_likes.delete_one({"postId": post_id, "userId": current_user["id"]})
+    if result.deleted_count:
+        like_buffer.add(post_id, -1)
+    likes = with_pending_likes(post)["likes"]
+    event_bus.publish("community", "like.updated", {"postId": post_id, "likes": likes})
+    return {"success": True, "liked": False, "likes": likes}
 
 
 @api_router.post("/community-posts/{post_id}/comment")
@@ -1535,24 +3016,79 @@ async def add_comment_to_post(post_id: str, author: str = Body(...), content: st
         "content": content,
         "date": datetime.now(timezone.utc).isoformat()
     }
+    # The $slice below would drop older embedded comments a worker has not migrated yet
+    legacy = await db.community_posts.find_one(
+        {"id": post_id, "commentsMigrated": {"$ne": True}}, {"_id": 0, "id": 1, "comments": 1}
+    )
+    if legacy:
+        await migrate_post_comments(legacy)
+    
+    # Bounded update: bump the count and keep only the newest few comments inline
     result = await db.community_posts.update_one(
         {"id": post_id},
-        {"$push": {"comments": comment}}
+        {
+            "$push": {"comments": {"$each": [comment], "$slice": -COMMENT_PREVIEW_SIZE}},
+            "$inc": {"commentCount": 1}
+        }
     )
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Post not found")
+    await db.community_comments.insert_one({**comment, "postId": post_id})
+    event_bus.publish("community", "comment.created", {"postId": post_id, "comment": comment})
     return {"success": True, "comment": comment}
 
 
+@api_router.get("/community-posts/{post_id}/comments")
+async def get_post_comments(
+    post_id: str,
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = None
+):
+    """Page through a post's comments, newest first"""
+    query = {"postId": post_id}
+    if cursor:
+        query.update(before_cursor(cursor))
+    comments = await db.community_comments.find(
+        query, {"_id": 0, "postId": 0}
+    ).sort([("date", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor(comments[-1]["date"], comments[-1]["id"])
+    return {"comments": comments, "nextCursor": next_cursor}
+
+
 @api_router.delete("/community-posts/{post_id}")
 async def delete_community_post(post_id: str):
     """Delete a community post"""
     result = await db.community_posts.delete_one({"id": post_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Post not found")
+    await db.community_comments.delete_many({"postId": post_id})
+    await db.post_likes.delete_many({"postId": post_id})
+    like_buffer.discard(post_id)
+    event_bus.publish("community", "post.deleted", {"postId": post_id})
     return {"success": True, "message": "Post deleted"}
 
 
+@api_router.get("/admin/community/likes")
+async def get_like_buffer_stats(current_admin: dict = Depends(get_current_admin_user)):
+    """Like write-coalescing metrics for this worker (admin only)"""
+    return {
+        "likes": like_buffer.likes,
+        "postWrites": like_buffer.writes,
+        "pendingPosts": len(like_buffer.deltas)
+    }
+
+
+@api_router.post("/admin/community/migrate-comments")
+async def migrate_comments_endpoint(current_admin: dict = Depends(get_current_admin_user)):
+    """Move any remaining embedded comments into their own collection (admin only)"""
+    migrated = await migrate_embedded_comments()
+    return {"success": True, "message": f"Migrated comments for {migrated} posts"}
+
+
 # ============= CONTRACT TEMPLATES API =============
 
 class ContractTemplateModel(BaseModel):
@@ -1767,9 +3303,30 @@ class TaxSettingsModel(BaseModel):
     taxRate: float = 0.08  # 8% default
     taxLabel: str = "Sales Tax"
 
-@api_router.get("/settings/tax")
-async def get_tax_settings():
-    """Get current tax settings"""
+class CachedValue:
+    """A single lazily loaded value with a TTL; concurrent misses share one load"""
+    
+    def __init__(self, loader, ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.value = None
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def get(self):
+        if self.value is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return self.value
+        async with self.lock:
+            if self.value is None or time.monotonic() - self.loaded_at >= self.ttl:
+                self.value = await self.loader()
+                self.loaded_at = time.monotonic()
+        return self.value
+    
+    def invalidate(self, *keys: str):
+        self.value = None
+
+
+async def load_tax_settings() -> dict:
     settings = await db.settings.find_one({"type": "tax"}, {"_id": 0})
     if not settings:
         # Return default settings from env or defaults
@@ -1780,6 +3337,50 @@ async def get_tax_settings():
         }
     return settings
 
+
+def size_options(doc: dict) -> List[dict]:
+    """Sizes as {"name", "price"} dicts; legacy plain-string sizes use the base price"""
+    return [
+        size if isinstance(size, dict) else {"name": size, "price": doc.get("price", 0)}
+        for size in doc.get("sizes") or []
+    ]
+
+
+async def load_catalog() -> dict:
+    """Purchasable catalog items by id, with the fields pricing needs"""
+    fields = {"_id": 0, "id": 1, "name": 1, "price": 1, "sizes": 1, "flavors": 1, "packageDeals": 1, "dropInPrice": 1, "addOns": 1}
+    products, classes, retreats = await asyncio.gather(
+        db.products.find({}, fields).to_list(None),
+        db.classes.find({}, fields).to_list(None),
+        db.retreats.find({}, fields).to_list(None)
+    )
+    catalog = {}
+    for kind, docs in (("product", products), ("class", classes), ("retreat", retreats)):
+        for doc in docs:
+            if doc.get("id"):
+                catalog[doc["id"]] = {**doc, "kind": kind, "sizes": size_options(doc)}
+    return catalog
+
+
+SETTINGS_CACHE_TTL = float(os.environ.get("SETTINGS_CACHE_TTL", "300"))
+tax_settings_cache = CachedValue(load_tax_settings, SETTINGS_CACHE_TTL)
+catalog_cache = CachedValue(load_catalog, SETTINGS_CACHE_TTL)
+invalidation_bus.register("tax", tax_settings_cache.invalidate)
+
+
+def invalidate_catalog(*keys: str):
+    catalog_cache.invalidate()
+    analytics_cache.invalidate("catalog")
+
+
+invalidation_bus.register("catalog", invalidate_catalog)
+
+
+@api_router.get("/settings/tax")
+async def get_tax_settings():
+    """Get current tax settings"""
+    return await tax_settings_cache.get()
+
 @api_router.put("/settings/tax")
 async def update_tax_settings(
     settings: TaxSettingsModel,
@@ -1796,58 +3397,680 @@ async def update_tax_settings(
         {"$set": settings_dict},
         upsert=True
     )
+    invalidation_bus.publish("tax")
     
     return {"success": True, "message": "Tax settings updated", "settings": settings_dict}
 
 
+# ============= CHECKOUT QUOTES =============
+
+class QuoteItem(BaseModel):
+    id: str  # catalog id, or a cart id such as "<product>-<size>-<flavor>" / "<class>-pkg-<sessions>"
+    quantity: int = Field(default=1, ge=1)
+    size: Optional[str] = None
+    addOns: List[str] = []  # add-on names for classes and retreats
+
+
+class QuoteRequest(BaseModel):
+    items: List[QuoteItem]
+
+
+def to_cents(amount) -> int:
+    return int(round(float(amount or 0) * 100))
+
+
+def resolve_catalog_variant(item_id: str, catalog: dict) -> Optional[tuple]:
+    """(catalog entry, size name or None) for a catalog id or a "<product>-<size>-<flavor>" cart id"""
+    if item_id in catalog:
+        return catalog[item_id], None
+    # Product ids, size names and flavors may all contain dashes, so try each
+    # split point and accept the one whose suffix names a real size/flavor
+    for position in reversed([i for i, char in enumerate(item_id) if char == "-"]):
+        entry = catalog.get(item_id[:position])
+        if entry is None or entry["kind"] != "product":
+            continue
+        suffix = item_id[position + 1:]
+        sizes = [s.get("name") for s in entry.get("sizes") or []]
+        flavors = entry.get("flavors") or []
+        if suffix in sizes:
+            return entry, suffix
+        if suffix in flavors:
+            return entry, None
+        for size in sizes:
+            if any(suffix == f"{size}-{flavor}" for flavor in flavors):
+                return entry, size
+    return None
+
+
+def catalog_item_id(item_id: str, catalog: dict) -> str:
+    """Catalog id a cart id refers to; unknown ids (e.g. deleted products) are returned unchanged"""
+    package = re.fullmatch(r"(.+)-pkg-(\d+)", item_id)
+    if package and package.group(1) in catalog:
+        return package.group(1)
+    resolved = resolve_catalog_variant(item_id, catalog)
+    return resolved[0]["id"] if resolved else item_id
+
+
+def resolve_unit_price(item: QuoteItem, catalog: dict) -> tuple:
+    """(name, unit price in cents, add-ons in cents) for one cart line"""
+    package = re.fullmatch(r"(.+)-pkg-(\d+)", item.id)
+    if package and package.group(1) in catalog:
+        entry, sessions = catalog[package.group(1)], int(package.group(2))
+        deal = next((d for d in entry.get("packageDeals") or [] if int(d.get("sessions", 0)) == sessions), None)
+        if deal:
+            name, price = f"{entry['name']} - {deal.get('name', '')}", deal.get("price", 0)
+        elif sessions == 1 and entry.get("dropInPrice"):
+            name, price = f"{entry['name']} - Single Drop-in", entry["dropInPrice"]
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown package for {entry['name']}")
+    else:
+        resolved = resolve_catalog_variant(item.id, catalog)
+        if resolved is None:
+            raise HTTPException(status_code=400, detail=f"Unknown item: {item.id}")
+        entry, variant_size = resolved
+        name, price = entry["name"], entry.get("price", 0)
+        size = item.size or variant_size
+        if size:
+            variant = next((s for s in entry.get("sizes") or [] if s.get("name") == size), None)
+            if variant is None:
+                raise HTTPException(status_code=400, detail=f"Unknown size '{size}' for {entry['name']}")
+            name, price = f"{entry['name']} ({size})", variant.get("price", price)
+    
+    add_on_prices = {a.get("name"): a.get("price", 0) for a in entry.get("addOns") or []}
+    unknown = [a for a in item.addOns if a not in add_on_prices]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown add-ons for {entry['name']}: {', '.join(unknown)}")
+    return name, to_cents(price), sum(to_cents(add_on_prices[a]) for a in item.addOns)
+
+
+async def price_cart(items: List[QuoteItem]) -> dict:
+    """Price a cart from the cached catalog and tax settings, in integer cents"""
+    catalog, tax = await asyncio.gather(catalog_cache.get(), tax_settings_cache.get())
+    resolved = [resolve_unit_price(item, catalog) for item in items]
+    
+    unit = np.array([r[1] for r in resolved], dtype=np.int64)
+    add_ons = np.array([r[2] for r in resolved], dtype=np.int64)
+    quantity = np.array([item.quantity for item in items], dtype=np.int64)
+    line_totals = (unit + add_ons) * quantity
+    subtotal = int(line_totals.sum())
+    
+    # Rate in parts per million, rounded half up, keeps tax in exact integer arithmetic
+    rate_ppm = round(float(tax.get("taxRate", 0)) * 1_000_000) if tax.get("taxEnabled") else 0
+    tax_cents = (subtotal * rate_ppm + 500_000) // 1_000_000
+    return {
+        "items": [
+            {
+                "id": item.id,
+                "name": name,
+                "quantity": item.quantity,
+                "unitPrice": int(unit_cents),
+                "addOns": int(add_on_cents),
+                "lineTotal": int(line_total)
+            }
+            for item, (name, _, _), unit_cents, add_on_cents, line_total in zip(items, resolved, unit, add_ons, line_totals)
+        ],
+        "subtotal": subtotal,
+        "tax": tax_cents,
+        "total": subtotal + tax_cents,
+        "taxRate": tax.get("taxRate", 0) if tax.get("taxEnabled") else 0,
+        "taxLabel": tax.get("taxLabel", "Sales Tax"),
+        "currency": "USD"
+    }
+
+
+@api_router.post("/checkout/quote")
+async def get_checkout_quote(quote: QuoteRequest):
+    """Price a cart server-side: line totals, subtotal, tax and total in cents"""
+    if not quote.items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    return await price_cart(quote.items)
+
+
 # ============= ANALYTICS API =============
 
-@api_router.get("/analytics/dashboard")
-async def get_dashboard_analytics():
-    """Get comprehensive dashboard analytics"""
+class AnalyticsCache:
+    """TTL cache for analytics responses.
+    
+    Fresh entries are served directly; entries past their TTL but inside the
+    stale window are served while one background refresh runs. Concurrent
+    misses for the same key share a single computation. Entries are tagged
+    with the collections they read so writes can invalidate them.
+    """
+    
+    def __init__(self):
+        self.entries: Dict[tuple, tuple] = {}  # key -> (value, computed_at, tags)
+        self.inflight: Dict[tuple, asyncio.Task] = {}
+        self.generation = 0
+    
+    async def get(self, key: tuple, compute, ttl: float, stale: float, tags: tuple):
+        entry = self.entries.get(key)
+        if entry:
+            value, computed_at, _ = entry
+            age = time.monotonic() - computed_at
+            if age < ttl:
+                return value
+            if age < ttl + stale:
+                self.refresh(key, compute, tags)
+                return value
+        return await asyncio.shield(self.refresh(key, compute, tags))
+    
+    def refresh(self, key: tuple, compute, tags: tuple) -> asyncio.Task:
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.compute(key, compute, tags))
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.finish(key, t))
+        return task
+    
+    async def compute(self, key: tuple, compute, tags: tuple):
+        generation = self.generation
+        value = await compute()
+        # Don't cache a result that raced with an invalidation
+        if generation == self.generation:
+            self.entries[key] = (value, time.monotonic(), tags)
+        return value
+    
+    def finish(self, key: tuple, task: asyncio.Task):
+        self.inflight.pop(key, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Analytics refresh for {key[0]} failed: {task.exception()}")
+    
+    def invalidate(self, *tags: str):
+        """Drop every entry that depends on any of the given collections"""
+        self.generation += 1
+        for key in [k for k, (_, _, entry_tags) in self.entries.items() if set(tags) & set(entry_tags)]:
+            del self.entries[key]
+
+
+analytics_cache = AnalyticsCache()
+invalidation_bus.register("analytics", analytics_cache.invalidate)
+
+
+def cached_analytics(ttl: float, tags: tuple, stale: float = 300):
+    """Serve an analytics endpoint through analytics_cache, keyed by its arguments"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            key = (func.__name__, tuple(sorted(kwargs.items())))
+            return await analytics_cache.get(key, lambda: func(**kwargs), ttl, stale, tags)
+        return wrapper
+    return decorator
+
+
+# Orders in these statuses count towards revenue
+REVENUE_STATUSES = ["completed", "pending"]
+
+# A rollup rebuild holds a lock document in rollup_rebuilds. While it is held,
+# live writers record that they skipped an update (`deferred`) instead of
+# applying it to the collection about to be replaced; the rebuild then runs
+# another pass, which reads their change from the source collections.
+ROLLUP_REBUILD_LEASE = timedelta(minutes=10)
+ROLLUP_REBUILD_PASSES = 5
+
+
+class RollupRebuildRunning(Exception):
+    """Another worker is already rebuilding this rollup"""
+
+
+async def rollup_rebuild_pending(rollup: str) -> bool:
+    """Whether a rebuild of this rollup is running; if so, the caller's update is left to it"""
+    lock = await db.rollup_rebuilds.find_one_and_update(
+        {"_id": rollup, "expiresAt": {"$gt": datetime.now(timezone.utc)}},
+        {"$inc": {"deferred": 1}}
+    )
+    return lock is not None
+
+
+async def run_rollup_rebuild(rollup: str, build):
+    """Run `build` under the rollup's cross-worker lock until a pass completes with no deferred updates"""
+    owner = uuid.uuid4().hex
     now = datetime.now(timezone.utc)
-    thirty_days_ago = (now - timedelta(days=30)).isoformat()
+    try:
+        # An existing unexpired lock fails the match, and the upsert then collides on _id
+        await db.rollup_rebuilds.update_one(
+            {"_id": rollup, "expiresAt": {"$lte": now}},
+            {"$set": {"owner": owner, "deferred": 0, "expiresAt": now + ROLLUP_REBUILD_LEASE}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        raise RollupRebuildRunning(rollup)
+    try:
+        for _ in range(ROLLUP_REBUILD_PASSES):
+            await db.rollup_rebuilds.update_one(
+                {"_id": rollup, "owner": owner},
+                {"$set": {"deferred": 0, "expiresAt": datetime.now(timezone.utc) + ROLLUP_REBUILD_LEASE}}
+            )
+            result = await build()
+            released = await db.rollup_rebuilds.delete_one({"_id": rollup, "owner": owner, "deferred": 0})
+            if released.deleted_count:
+                return result
+        logger.warning(f"Rebuild of {rollup} kept racing live updates; run it again when traffic is lower")
+        return result
+    finally:
+        await db.rollup_rebuilds.delete_one({"_id": rollup, "owner": owner})
+
+
+def sales_product_id(item: dict, catalog: Optional[dict] = None) -> str:
+    """Product an order item counts towards; size/flavor variants roll up into their product.
     
-    # Get counts
-    products_count = await db.products.count_documents({})
-    services_count = await db.services.count_documents({})
-    classes_count = await db.classes.count_documents({})
-    retreats_count = await db.retreats.count_documents({})
-    users_count = await db.auth_users.count_documents({})
-    orders_count = await db.orders.count_documents({})
-    appointments_count = await db.appointments.count_documents({})
-    fundraisers_count = await db.fundraisers.count_documents({})
-    emergency_count = await db.emergency_requests.count_documents({"status": "pending"})
+    Orders record it as productId; items saved before that are resolved against the catalog.
+    """
+    return item.get("productId") or catalog_item_id(item.get("id", ""), catalog or {})
+
+
+def sales_product_name(item: dict) -> str:
+    """Item name without the " (Large - Vanilla)" variant suffix the cart adds"""
+    name = item.get("name", "Unknown")
+    if sales_product_id(item) != item.get("id") and name.endswith(")") and " (" in name:
+        return name[:name.rindex(" (")]
+    return name
+
+
+async def record_order_status_change(order: dict, old_status: Optional[str], new_status: str):
+    """Keep the order rollups (revenue, product sales, cohorts, recommendations) in step with an order's status"""
+    invalidation_bus.publish("analytics", "orders")
+    if new_status == "completed" and old_status != "completed":
+        recommender.add_basket(order_basket(order), order.get("id"))
+        if order.get("customer_email"):
+            try:
+                await record_cohort_purchase(order)
+            except Exception as e:
+                logger.error(f"Failed to update cohort rollup: {str(e)}")
+    
+    delta = int(new_status in REVENUE_STATUSES) - int(old_status in REVENUE_STATUSES)
+    if delta == 0 or not order.get("created_at"):
+        return
+    try:
+        if not await rollup_rebuild_pending("revenue_daily"):
+            await db.revenue_daily.update_one(
+                {"day": order["created_at"][:10], "payment_type": order.get("payment_type") or "other"},
+                {"$inc": {
+                    "revenue": delta * order.get("total_amount", 0),
+                    "orders": delta
+                }},
+                upsert=True
+            )
+        item_updates = [
+            UpdateOne(
+                {"product_id": sales_product_id(item)},
+                {
+                    "$inc": {
+                        "quantity": delta * item.get("quantity", 1),
+                        "revenue": delta * item.get("price", 0) * item.get("quantity", 1)
+                    },
+                    "$setOnInsert": {"name": sales_product_name(item)}
+                },
+                upsert=True
+            )
+            for item in order.get("items", [])
+        ]
+        if item_updates and not await rollup_rebuild_pending("product_sales"):
+            await db.product_sales.bulk_write(item_updates, ordered=False)
+    except Exception as e:
+        # Never fail a payment over analytics; a rebuild will repair the rollups
+        logger.error(f"Failed to update revenue rollups: {str(e)}")
+
+
+async def rebuild_revenue_rollup() -> int:
+    """Recompute revenue_daily from the orders collection; raises RollupRebuildRunning if one is in progress"""
+    return await run_rollup_rebuild("revenue_daily", build_revenue_rollup)
+
+
+async def build_revenue_rollup() -> int:
+    # $out replaces the collection atomically and keeps its indexes
+    await db.orders.aggregate([
+        {"$match": {"status": {"$in": REVENUE_STATUSES}, "created_at": {"$type": "string"}}},
+        {"$group": {
+            "_id": {
+                "day": {"$substrCP": ["$created_at", 0, 10]},
+                "payment_type": {"$ifNull": ["$payment_type", "other"]}
+            },
+            "revenue": {"$sum": {"$ifNull": ["$total_amount", 0]}},
+            "orders": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "payment_type": "$_id.payment_type",
+            "revenue": 1,
+            "orders": 1
+        }},
+        {"$out": "revenue_daily"}
+    ]).to_list(None)
+    return await db.revenue_daily.count_documents({})
+
+
+def parse_iso_param(value: Optional[str], name: str) -> Optional[str]:
+    """Validate an ISO date or datetime query parameter and return it in canonical form"""
+    if value is None:
+        return None
+    try:
+        if len(value) == 10:
+            return date.fromisoformat(value).isoformat()
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}' date")
+
+
+def date_range_filter(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    """Range filter on an ISO date string field; a bare end date includes that whole day"""
+    bounds = {}
+    if date_from:
+        bounds["$gte"] = date_from
+    if date_to:
+        bounds["$lte"] = date_to + "\uffff"
+    return bounds
+
+
+def product_sales_pipeline(match: dict) -> List[dict]:
+    """Aggregate quantity and revenue (cents) per product from order items.
+    
+    Mirrors sales_product_id: variants of a product are grouped under their
+    productId (see backfill_order_product_ids) and named after the product.
+    """
+    return [
+        {"$match": match},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"$ifNull": ["$items.productId", {"$ifNull": ["$items.id", ""]}]},
+            "name": {"$last": "$items.name"},
+            "quantity": {"$sum": {"$ifNull": ["$items.quantity", 1]}},
+            "revenue": {"$sum": {"$multiply": [
+                {"$ifNull": ["$items.price", 0]},
+                {"$ifNull": ["$items.quantity", 1]}
+            ]}}
+        }},
+        {"$lookup": {"from": "products", "localField": "_id", "foreignField": "id", "as": "product"}},
+        {"$set": {"name": {"$ifNull": [{"$arrayElemAt": ["$product.name", 0]}, "$name"]}}},
+        {"$unset": "product"}
+    ]
+
+
+async def backfill_order_product_ids() -> int:
+    """Record productId on order items saved before orders stored it; returns the orders updated"""
+    catalog = await catalog_cache.get()
+    updates = []
+    async for order in db.orders.find({"items": {"$elemMatch": {"productId": None}}}, {"_id": 0, "id": 1, "items": 1}):
+        items = [{**item, "productId": sales_product_id(item, catalog)} for item in order["items"]]
+        updates.append(UpdateOne({"id": order["id"]}, {"$set": {"items": items}}))
+    for i in range(0, len(updates), 1000):
+        await db.orders.bulk_write(updates[i:i + 1000], ordered=False)
+    return len(updates)
+
+
+async def rebuild_product_sales() -> int:
+    """Recompute the per-product sales counters from the orders collection; raises RollupRebuildRunning if one is in progress"""
+    return await run_rollup_rebuild("product_sales", build_product_sales)
+
+
+async def build_product_sales() -> int:
+    await db.orders.aggregate(
+        product_sales_pipeline({"status": {"$in": REVENUE_STATUSES}}) + [
+            {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "quantity": 1, "revenue": 1}},
+            {"$out": "product_sales"}
+        ]
+    ).to_list(None)
+    return await db.product_sales.count_documents({})
+
+
+@api_router.post("/admin/analytics/products/rebuild")
+async def rebuild_product_analytics(current_admin: dict = Depends(get_current_admin_user)):
+    """Rebuild the per-product sales counters from all orders (admin only)"""
+    try:
+        rows = await rebuild_product_sales()
+    except RollupRebuildRunning:
+        raise HTTPException(status_code=409, detail="A product sales rebuild is already running")
+    return {"success": True, "message": f"Product sales rebuilt: {rows} products"}
+
+
+def month_offset(cohort: str, month: str) -> int:
+    """Number of months between two YYYY-MM strings (never negative)"""
+    start_year, start_month = map(int, cohort.split("-"))
+    year, month_number = map(int, month.split("-"))
+    return max(0, (year * 12 + month_number) - (start_year * 12 + start_month))
+
+
+def cohort_increments(offset: int, purchase_count: int, first_in_month: bool, amount: int) -> dict:
+    """Counter changes to a signup cohort for one completed purchase"""
+    increments = {"orders": 1, "revenue": amount}
+    if first_in_month:
+        increments[f"active.{offset}"] = 1
+    if purchase_count == 1:
+        increments["purchasers"] = 1
+    elif purchase_count == 2:
+        increments["repeat_purchasers"] = 1
+    return increments
+
+
+def user_cohort_month(user: dict) -> str:
+    return (user.get("created_at") or user.get("joinedDate") or "")[:7]
+
+
+async def record_cohort_signup(created_at: str, count: int = 1):
+    if await rollup_rebuild_pending("user_cohorts"):
+        return
+    await db.user_cohorts.update_one({"cohort": created_at[:7]}, {"$inc": {"size": count}}, upsert=True)
+
+
+async def record_cohort_removal(user: dict):
+    """Take a deleted user's signup, purchases and activity back out of their cohort"""
+    if await rollup_rebuild_pending("user_cohorts"):
+        return
+    months = await db.user_activity.distinct("month", {"email": user["email"]})
+    await db.user_activity.delete_many({"email": user["email"]})
+    cohort = user_cohort_month(user)
+    if not cohort:
+        return
+    # Orders are matched by email, as in rebuild_cohorts
+    purchases = await aggregate_one("orders", [
+        {"$match": {"status": "completed", "customer_email": user["email"]}},
+        {"$group": {"_id": None, "orders": {"$sum": 1}, "revenue": {"$sum": {"$ifNull": ["$total_amount", 0]}}}}
+    ])
+    decrements = {"size": -1}
+    if purchases:
+        decrements.update({"orders": -purchases["orders"], "revenue": -purchases["revenue"], "purchasers": -1})
+        if purchases["orders"] >= 2:
+            decrements["repeat_purchasers"] = -1
+    for month in months:
+        offset = f"active.{month_offset(cohort, month)}"
+        decrements[offset] = decrements.get(offset, 0) - 1
+    await db.user_cohorts.update_one({"cohort": cohort}, {"$inc": decrements})
+
+
+async def record_cohort_purchase(order: dict):
+    """Attribute a completed order to its customer's signup cohort (users are matched by email)"""
+    if await rollup_rebuild_pending("user_cohorts"):
+        return
+    user = await db.auth_users.find_one_and_update(
+        {"email": order["customer_email"]},
+        {"$inc": {"purchase_count": 1}},
+        projection={"_id": 0, "created_at": 1, "joinedDate": 1, "purchase_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user or not user_cohort_month(user):
+        return  # Guest checkout
+    cohort = user_cohort_month(user)
+    month = order["created_at"][:7]
+    
+    activity = await db.user_activity.update_one(
+        {"email": order["customer_email"], "month": month},
+        {"$setOnInsert": {"cohort": cohort}},
+        upsert=True
+    )
+    await db.user_cohorts.update_one(
+        {"cohort": cohort},
+        {"$inc": cohort_increments(
+            month_offset(cohort, month),
+            user["purchase_count"],
+            activity.upserted_id is not None,
+            order.get("total_amount", 0)
+        )},
+        upsert=True
+    )
+
+
+async def rebuild_cohorts() -> int:
+    """Recompute cohort counters, monthly activity and purchase counts from users and orders.
     
-    # Get orders for revenue calculation
-    orders = await db.orders.find({"status": {"$in": ["completed", "pending"]}}, {"_id": 0}).to_list(10000)
+    Raises RollupRebuildRunning if another rebuild is in progress.
+    """
+    return await run_rollup_rebuild("user_cohorts", build_cohorts)
+
+
+async def build_cohorts() -> int:
+    cohorts: Dict[str, dict] = {}
+    user_cohorts: Dict[str, str] = {}
+    async for user in db.auth_users.find({}, {"_id": 0, "email": 1, "created_at": 1, "joinedDate": 1}):
+        cohort = user_cohort_month(user)
+        if not cohort:
+            continue
+        user_cohorts[user["email"]] = cohort
+        cohorts.setdefault(cohort, {"cohort": cohort, "size": 0, "active": {}})["size"] += 1
     
-    total_revenue = sum(o.get("total_amount", 0) for o in orders) / 100  # Convert cents to dollars
+    purchase_counts: Dict[str, int] = {}
+    activity = set()
+    orders = db.orders.find(
+        {"status": "completed", "customer_email": {"$ne": None}},
+        {"_id": 0, "customer_email": 1, "created_at": 1, "total_amount": 1}
+    ).sort("created_at", 1)
+    async for order in orders:
+        email = order["customer_email"]
+        cohort = user_cohorts.get(email)
+        if not cohort or not order.get("created_at"):
+            continue
+        month = order["created_at"][:7]
+        purchase_counts[email] = purchase_counts.get(email, 0) + 1
+        first_in_month = (email, month) not in activity
+        activity.add((email, month))
+        
+        doc = cohorts[cohort]
+        increments = cohort_increments(month_offset(cohort, month), purchase_counts[email], first_in_month, order.get("total_amount", 0))
+        for field, value in increments.items():
+            if field.startswith("active."):
+                offset = field.split(".", 1)[1]
+                doc["active"][offset] = doc["active"].get(offset, 0) + value
+            else:
+                doc[field] = doc.get(field, 0) + value
     
-    # Recent orders (last 30 days)
-    recent_orders = [o for o in orders if o.get("created_at", "") >= thirty_days_ago]
-    monthly_revenue = sum(o.get("total_amount", 0) for o in recent_orders) / 100
+    activity_docs = [{"email": e, "month": m, "cohort": user_cohorts[e]} for e, m in activity]
+    for name, docs in (("user_cohorts", list(cohorts.values())), ("user_activity", activity_docs)):
+        if not docs:
+            await db[name].delete_many({})
+            continue
+        # Fill a staging collection and swap it in; $out replaces the live
+        # collection atomically and keeps its indexes
+        staging = db[f"{name}_rebuild"]
+        await staging.drop()
+        for i in range(0, len(docs), 1000):
+            await staging.insert_many(docs[i:i + 1000], ordered=False)
+        await staging.aggregate([{"$out": name}]).to_list(None)
+        await staging.drop()
     
-    # Get new users in last 30 days
-    new_users = await db.auth_users.count_documents({"created_at": {"$gte": thirty_days_ago}})
+    count_updates = [UpdateOne({"email": e}, {"$set": {"purchase_count": n}}) for e, n in purchase_counts.items()]
+    for i in range(0, len(count_updates), 1000):
+        await db.auth_users.bulk_write(count_updates[i:i + 1000], ordered=False)
+    await db.auth_users.update_many(
+        {"email": {"$nin": list(purchase_counts)}, "purchase_count": {"$ne": 0}},
+        {"$set": {"purchase_count": 0}}
+    )
+    return len(cohorts)
+
+
+@api_router.post("/admin/analytics/cohorts/rebuild")
+async def rebuild_cohort_analytics(current_admin: dict = Depends(get_current_admin_user)):
+    """Rebuild the signup cohort counters from all users and orders (admin only)"""
+    try:
+        rows = await rebuild_cohorts()
+    except RollupRebuildRunning:
+        raise HTTPException(status_code=409, detail="A cohort rebuild is already running")
+    invalidation_bus.publish("analytics", "users", "orders")
+    return {"success": True, "message": f"Cohorts rebuilt: {rows} cohorts"}
+
+
+@api_router.post("/admin/analytics/revenue/rebuild")
+async def rebuild_revenue_analytics(current_admin: dict = Depends(get_current_admin_user)):
+    """Rebuild the daily revenue rollup from all orders (admin only)"""
+    try:
+        rows = await rebuild_revenue_rollup()
+    except RollupRebuildRunning:
+        raise HTTPException(status_code=409, detail="A revenue rollup rebuild is already running")
+    return {"success": True, "message": f"Revenue rollup rebuilt: {rows} rows"}
+
+
+async def aggregate_one(collection: str, pipeline: List[dict]) -> dict:
+    """Run an aggregation expected to produce a single document"""
+    results = await db[collection].aggregate(pipeline).to_list(1)
+    return results[0] if results else {}
+
+
+def sum_if(condition: Any, value: Any = 1) -> dict:
+    """$sum accumulator that only counts documents matching a condition"""
+    return {"$sum": {"$cond": [condition, value, 0]}}
+
+
+@api_router.get("/analytics/dashboard")
+@cached_analytics(ttl=30, tags=("orders", "users", "appointments", "fundraisers", "emergencies", "catalog"))
+async def get_dashboard_analytics():
+    """Get comprehensive dashboard analytics"""
+    now = datetime.now(timezone.utc)
+    thirty_days_ago = (now - timedelta(days=30)).isoformat()
+    is_revenue = {"$in": ["$status", ["completed", "pending"]]}
+    amount = {"$ifNull": ["$total_amount", 0]}
     
-    # Get appointments by status
-    pending_appointments = await db.appointments.count_documents({"status": "pending"})
-    confirmed_appointments = await db.appointments.count_documents({"status": "confirmed"})
+    # Everything is reduced server-side; only scalars come back
+    (
+        products_count,
+        services_count,
+        classes_count,
+        retreats_count,
+        emergency_count,
+        order_stats,
+        user_stats,
+        appointment_stats,
+        fundraiser_stats
+    ) = await asyncio.gather(
+        db.products.count_documents({}),
+        db.services.count_documents({}),
+        db.classes.count_documents({}),
+        db.retreats.count_documents({}),
+        db.emergency_requests.count_documents({"status": "pending"}),
+        aggregate_one("orders", [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "revenue": sum_if(is_revenue, amount),
+            "monthlyRevenue": sum_if({"$and": [is_revenue, {"$gte": ["$created_at", thirty_days_ago]}]}, amount)
+        }}]),
+        aggregate_one("auth_users", [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "new": sum_if({"$gte": ["$created_at", thirty_days_ago]})
+        }}]),
+        aggregate_one("appointments", [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "pending": sum_if({"$eq": ["$status", "pending"]}),
+            "confirmed": sum_if({"$eq": ["$status", "confirmed"]})
+        }}]),
+        aggregate_one("fundraisers", [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "active": sum_if({"$eq": ["$status", "active"]}),
+            "raised": sum_if({"$eq": ["$status", "active"]}, {"$ifNull": ["$raisedAmount", 0]}),
+            "goal": sum_if({"$eq": ["$status", "active"]}, {"$ifNull": ["$goalAmount", 0]})
+        }}])
+    )
     
-    # Get fundraiser stats
-    active_fundraisers = await db.fundraisers.count_documents({"status": "active"})
-    fundraisers = await db.fundraisers.find({"status": "active"}, {"_id": 0}).to_list(100)
-    total_raised = sum(f.get("raisedAmount", 0) for f in fundraisers)
-    total_goal = sum(f.get("goalAmount", 0) for f in fundraisers)
+    total_raised = fundraiser_stats.get("raised", 0)
+    total_goal = fundraiser_stats.get("goal", 0)
+    pending_appointments = appointment_stats.get("pending", 0)
     
     return {
         "overview": {
-            "totalRevenue": total_revenue,
-            "monthlyRevenue": monthly_revenue,
-            "totalOrders": orders_count,
-            "totalUsers": users_count,
-            "newUsersThisMonth": new_users
+            "totalRevenue": order_stats.get("revenue", 0) / 100,  # Convert cents to dollars
+            "monthlyRevenue": order_stats.get("monthlyRevenue", 0) / 100,
+            "totalOrders": order_stats.get("total", 0),
+            "totalUsers": user_stats.get("total", 0),
+            "newUsersThisMonth": user_stats.get("new", 0)
         },
         "inventory": {
             "products": products_count,
@@ -1856,13 +4079,13 @@ async def get_dashboard_analytics():
             "retreats": retreats_count
         },
         "appointments": {
-            "total": appointments_count,
+            "total": appointment_stats.get("total", 0),
             "pending": pending_appointments,
-            "confirmed": confirmed_appointments
+            "confirmed": appointment_stats.get("confirmed", 0)
         },
         "fundraisers": {
-            "total": fundraisers_count,
-            "active": active_fundraisers,
+            "total": fundraiser_stats.get("total", 0),
+            "active": fundraiser_stats.get("active", 0),
             "totalRaised": total_raised,
             "totalGoal": total_goal,
             "percentageRaised": round((total_raised / total_goal * 100) if total_goal > 0 else 0, 1)
@@ -1875,26 +4098,24 @@ async def get_dashboard_analytics():
 
 
 @api_router.get("/analytics/revenue")
+@cached_analytics(ttl=60, tags=("orders",))
 async def get_revenue_analytics():
-    """Get detailed revenue analytics"""
-    orders = await db.orders.find({"status": {"$in": ["completed", "pending"]}}, {"_id": 0}).to_list(10000)
+    """Get detailed revenue analytics from the daily rollup"""
+    rows = await db.revenue_daily.find({}, {"_id": 0}).sort("day", 1).to_list(None)
     
     # Group by date
     daily_revenue = {}
     monthly_revenue = {}
     by_type = {"product": 0, "appointment": 0, "retreat": 0, "class": 0, "other": 0}
     
-    for order in orders:
-        amount = order.get("total_amount", 0) / 100
-        created_at = order.get("created_at", "")
-        payment_type = order.get("payment_type", "other")
+    for row in rows:
+        amount = row.get("revenue", 0) / 100
+        date_str = row["day"]  # YYYY-MM-DD
+        month_str = date_str[:7]  # YYYY-MM
+        payment_type = row.get("payment_type", "other")
         
-        if created_at:
-            date_str = created_at[:10]  # YYYY-MM-DD
-            month_str = created_at[:7]  # YYYY-MM
-            
-            daily_revenue[date_str] = daily_revenue.get(date_str, 0) + amount
-            monthly_revenue[month_str] = monthly_revenue.get(month_str, 0) + amount
+        daily_revenue[date_str] = daily_revenue.get(date_str, 0) + amount
+        monthly_revenue[month_str] = monthly_revenue.get(month_str, 0) + amount
         
         if payment_type in by_type:
             by_type[payment_type] += amount
@@ -1914,83 +4135,137 @@ async def get_revenue_analytics():
 
 
 @api_router.get("/analytics/products")
-async def get_product_analytics():
-    """Get product performance analytics"""
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
-    orders = await db.orders.find({}, {"_id": 0}).to_list(10000)
-    
-    # Count product sales
-    product_sales = {}
-    for order in orders:
-        for item in order.get("items", []):
-            product_id = item.get("id", "")
-            product_name = item.get("name", "Unknown")
-            quantity = item.get("quantity", 1)
-            price = item.get("price", 0) / 100
-            
-            if product_id not in product_sales:
-                product_sales[product_id] = {"name": product_name, "quantity": 0, "revenue": 0}
-            product_sales[product_id]["quantity"] += quantity
-            product_sales[product_id]["revenue"] += price * quantity
-    
-    # Sort by revenue
-    top_products = sorted(product_sales.values(), key=lambda x: x["revenue"], reverse=True)[:10]
-    
-    # Category breakdown
-    category_stats = {}
-    for product in products:
-        category = product.get("category", "uncategorized")
-        if category not in category_stats:
-            category_stats[category] = {"count": 0, "totalValue": 0}
-        category_stats[category]["count"] += 1
-        category_stats[category]["totalValue"] += product.get("price", 0)
+@cached_analytics(ttl=60, tags=("orders", "catalog"))
+async def get_product_analytics(
+    top: int = Query(10, gt=0, le=100),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """Get product performance analytics.
+    
+    Without a date range the top sellers come straight from the product_sales
+    counters; with one they are aggregated from orders in that range.
+    """
+    if date_from or date_to:
+        pipeline = product_sales_pipeline({
+            "status": {"$in": REVENUE_STATUSES},
+            "created_at": date_range_filter(date_from, date_to)
+        })
+        pipeline += [
+            {"$sort": {"revenue": -1}},
+            {"$limit": top},
+            {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "quantity": 1, "revenue": 1}}
+        ]
+        top_rows = db.orders.aggregate(pipeline)
+    else:
+        top_rows = db.product_sales.find({}, {"_id": 0}).sort("revenue", -1).limit(top)
+    
+    top_products, categories = await asyncio.gather(
+        top_rows.to_list(top),
+        db.products.aggregate([
+            {"$group": {
+                "_id": {"$ifNull": ["$category", "uncategorized"]},
+                "count": {"$sum": 1},
+                "totalValue": {"$sum": {"$ifNull": ["$price", 0]}}
+            }}
+        ]).to_list(None)
+    )
     
     return {
-        "totalProducts": len(products),
-        "topSellingProducts": top_products,
-        "categoryBreakdown": [{"category": k, **v} for k, v in category_stats.items()]
+        "totalProducts": sum(c["count"] for c in categories),
+        "topSellingProducts": [{
+            "id": p["product_id"],
+            "name": p.get("name", "Unknown"),
+            "quantity": p.get("quantity", 0),
+            "revenue": p.get("revenue", 0) / 100
+        } for p in top_products],
+        "categoryBreakdown": [
+            {"category": c["_id"], "count": c["count"], "totalValue": c["totalValue"]}
+            for c in categories
+        ]
     }
 
 
 @api_router.get("/analytics/users")
+@cached_analytics(ttl=60, tags=("users",))
 async def get_user_analytics():
     """Get user growth analytics"""
-    users = await db.auth_users.find({}, {"_id": 0, "hashed_password": 0}).to_list(10000)
+    signup_date = {"$ifNull": ["$created_at", {"$ifNull": ["$joinedDate", ""]}]}
+    facets = await aggregate_one("auth_users", [{"$facet": {
+        "total": [{"$count": "n"}],
+        "daily": [
+            {"$match": {"$expr": {"$gt": [signup_date, ""]}}},
+            {"$group": {"_id": {"$substrCP": [signup_date, 0, 10]}, "signups": {"$sum": 1}}},
+            {"$sort": {"_id": -1}},
+            {"$limit": 30}
+        ],
+        "monthly": [
+            {"$match": {"$expr": {"$gt": [signup_date, ""]}}},
+            {"$group": {"_id": {"$substrCP": [signup_date, 0, 7]}, "signups": {"$sum": 1}}},
+            {"$sort": {"_id": -1}},
+            {"$limit": 12}
+        ],
+        "roles": [{"$group": {"_id": {"$ifNull": ["$role", "user"]}, "count": {"$sum": 1}}}],
+        "memberships": [{"$group": {"_id": {"$ifNull": ["$membershipLevel", "basic"]}, "count": {"$sum": 1}}}]
+    }}])
     
-    # Group by registration date
-    daily_signups = {}
-    monthly_signups = {}
     role_breakdown = {"admin": 0, "user": 0}
-    membership_breakdown = {}
+    role_breakdown.update({r["_id"]: r["count"] for r in facets.get("roles", [])})
     
-    for user in users:
-        created_at = user.get("created_at", user.get("joinedDate", ""))
-        role = user.get("role", "user")
-        membership = user.get("membershipLevel", "basic")
-        
-        if created_at:
-            date_str = created_at[:10]
-            month_str = created_at[:7]
-            daily_signups[date_str] = daily_signups.get(date_str, 0) + 1
-            monthly_signups[month_str] = monthly_signups.get(month_str, 0) + 1
-        
-        role_breakdown[role] = role_breakdown.get(role, 0) + 1
-        membership_breakdown[membership] = membership_breakdown.get(membership, 0) + 1
+    return {
+        "totalUsers": facets["total"][0]["n"] if facets.get("total") else 0,
+        "dailySignups": [{"date": d["_id"], "signups": d["signups"]} for d in reversed(facets.get("daily", []))],
+        "monthlySignups": [{"month": m["_id"], "signups": m["signups"]} for m in reversed(facets.get("monthly", []))],
+        "roleBreakdown": role_breakdown,
+        "membershipBreakdown": {m["_id"]: m["count"] for m in facets.get("memberships", [])}
+    }
+
+
+@api_router.get("/analytics/cohorts")
+@cached_analytics(ttl=300, tags=("users", "orders"))
+async def get_cohort_analytics(months: int = Query(12, gt=0, le=120)):
+    """Monthly signup cohorts with purchase retention and repeat-purchase rates"""
+    docs = await db.user_cohorts.find({}, {"_id": 0}).sort("cohort", -1).to_list(months)
+    docs.reverse()
+    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
+    # Only months that have already happened are reported for each cohort
+    spans = [month_offset(d["cohort"], current_month) + 1 for d in docs]
+    width = max(spans, default=0)
     
-    # Format data
-    daily_data = [{"date": k, "signups": v} for k, v in sorted(daily_signups.items())[-30:]]
-    monthly_data = [{"month": k, "signups": v} for k, v in sorted(monthly_signups.items())[-12:]]
+    # Cohort x months-since-signup matrix of active purchasers
+    active = np.zeros((len(docs), width))
+    for row, doc in enumerate(docs):
+        for offset, count in doc.get("active", {}).items():
+            if int(offset) < width:
+                active[row, int(offset)] = count
+    sizes = np.array([d.get("size", 0) for d in docs], dtype=float)
+    purchasers = np.array([d.get("purchasers", 0) for d in docs], dtype=float)
+    repeaters = np.array([d.get("repeat_purchasers", 0) for d in docs], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        retention = np.where(sizes[:, None] > 0, active / sizes[:, None] * 100, 0)
+        repeat_rate = np.where(purchasers > 0, repeaters / purchasers * 100, 0)
     
     return {
-        "totalUsers": len(users),
-        "dailySignups": daily_data,
-        "monthlySignups": monthly_data,
-        "roleBreakdown": role_breakdown,
-        "membershipBreakdown": membership_breakdown
+        "cohorts": [{
+            "cohort": doc["cohort"],
+            "size": doc.get("size", 0),
+            "purchasers": doc.get("purchasers", 0),
+            "repeatPurchasers": doc.get("repeat_purchasers", 0),
+            "repeatPurchaseRate": round(float(repeat_rate[row]), 1),
+            "revenue": doc.get("revenue", 0) / 100,
+            "active": active[row, :spans[row]].astype(int).tolist(),
+            "retention": np.round(retention[row, :spans[row]], 1).tolist()
+        } for row, doc in enumerate(docs)],
+        "overall": {
+            "users": int(sizes.sum()),
+            "purchasers": int(purchasers.sum()),
+            "repeatPurchaseRate": round(float(repeaters.sum() / purchasers.sum() * 100) if purchasers.sum() > 0 else 0, 1)
+        }
     }
 
 
 @api_router.get("/analytics/appointments")
+@cached_analytics(ttl=60, tags=("appointments", "catalog"))
 async def get_appointment_analytics():
     """Get appointment analytics"""
     appointments = await db.appointments.find({}, {"_id": 0}).to_list(10000)
@@ -2026,6 +4301,7 @@ async def get_appointment_analytics():
 
 
 @api_router.get("/analytics/classes")
+@cached_analytics(ttl=300, tags=("catalog",))
 async def get_class_analytics():
     """Get class enrollment analytics"""
     classes = await db.classes.find({}, {"_id": 0}).to_list(100)
@@ -2052,6 +4328,7 @@ async def get_class_analytics():
 
 
 @api_router.get("/analytics/retreats")
+@cached_analytics(ttl=300, tags=("catalog",))
 async def get_retreat_analytics():
     """Get retreat booking analytics"""
     retreats = await db.retreats.find({}, {"_id": 0}).to_list(100)
@@ -2078,6 +4355,7 @@ async def get_retreat_analytics():
 
 
 @api_router.get("/analytics/fundraisers")
+@cached_analytics(ttl=120, tags=("fundraisers",))
 async def get_fundraiser_analytics():
     """Get fundraiser analytics"""
     fundraisers = await db.fundraisers.find({}, {"_id": 0}).to_list(100)
@@ -2112,6 +4390,323 @@ async def get_fundraiser_analytics():
     }
 
 
+# ============= ANALYTICS SNAPSHOTS =============
+
+async def take_analytics_snapshot() -> dict:
+    """Store today's key metrics (UTC day) in analytics_snapshots, replacing any earlier one"""
+    now = datetime.now(timezone.utc)
+    dashboard, retreats, fundraisers = await asyncio.gather(
+        get_dashboard_analytics.__wrapped__(),  # Bypass the response cache
+        db.retreats.find({}, {"_id": 0, "id": 1, "name": 1, "capacity": 1, "spotsLeft": 1}).to_list(None),
+        db.fundraisers.find({}, {
+            "_id": 0, "id": 1, "title": 1, "status": 1,
+            "raisedAmount": 1, "goalAmount": 1, "contributors": 1
+        }).to_list(None)
+    )
+    
+    capacity = sum(r.get("capacity", 0) for r in retreats)
+    booked = capacity - sum(r.get("spotsLeft", r.get("capacity", 0)) for r in retreats)
+    snapshot = {
+        "date": now.strftime("%Y-%m-%d"),
+        "takenAt": now.isoformat(),
+        "overview": dashboard["overview"],
+        "appointments": dashboard["appointments"],
+        "alerts": dashboard["alerts"],
+        "retreats": {
+            "capacity": capacity,
+            "booked": booked,
+            "occupancyRate": round((booked / capacity * 100) if capacity > 0 else 0, 1),
+            "items": retreats
+        },
+        "fundraisers": {
+            "totalRaised": sum(f.get("raisedAmount", 0) for f in fundraisers),
+            "totalGoal": sum(f.get("goalAmount", 0) for f in fundraisers),
+            "contributors": sum(f.get("contributors", 0) for f in fundraisers),
+            "items": fundraisers
+        }
+    }
+    await db.analytics_snapshots.replace_one({"date": snapshot["date"]}, snapshot, upsert=True)
+    return snapshot
+
+
+async def run_daily_snapshots(hour: int):
+    """Take a snapshot now if today's is missing, then once a day at the given UTC hour"""
+    try:
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if not await db.analytics_snapshots.find_one({"date": today}):
+            await take_analytics_snapshot()
+    except Exception as e:
+        logger.error(f"Analytics snapshot failed: {str(e)}")
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            await take_analytics_snapshot()
+        except Exception as e:
+            logger.error(f"Analytics snapshot failed: {str(e)}")
+
+
+# Top-level snapshot sections `fields` may select (dotted sub-paths are allowed)
+SNAPSHOT_SECTIONS = ("date", "takenAt", "overview", "appointments", "alerts", "retreats", "fundraisers")
+
+
+@api_router.get("/analytics/snapshots")
+async def get_analytics_snapshots(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    fields: Optional[str] = None
+):
+    """Daily metric snapshots in a date range; `fields` limits the sections returned (e.g. overview,retreats)"""
+    query = {"date": date_range_filter(date_from, date_to)} if date_from or date_to else {}
+    projection = {"_id": 0}
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f.split(".")[0] not in SNAPSHOT_SECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(SNAPSHOT_SECTIONS)}")
+        # Mongo rejects a path alongside one of its ancestors; the ancestor already covers it
+        requested = [
+            f for f in dict.fromkeys(requested)
+            if not any(f.startswith(f"{other}.") for other in requested)
+        ]
+        projection = {"date": 1, **{f: 1 for f in requested if f != "date" and not f.startswith("date.")}, "_id": 0}
+    snapshots = await db.analytics_snapshots.find(query, projection).sort("date", 1).to_list(3660)
+    return snapshots
+
+
+@api_router.post("/admin/analytics/snapshots")
+async def create_analytics_snapshot(current_admin: dict = Depends(get_current_admin_user)):
+    """Take (or refresh) today's analytics snapshot now (admin only)"""
+    snapshot = await take_analytics_snapshot()
+    return {"success": True, "date": snapshot["date"]}
+
+
+# ============= CSV EXPORTS =============
+
+def dollars(field: str) -> dict:
+    return {"$divide": [{"$ifNull": [field, 0]}, 100]}
+
+
+# report -> (collection, date field, pipeline stages after the date $match, columns)
+EXPORT_REPORTS = {
+    "revenue": ("revenue_daily", "day", [
+        {"$sort": {"day": 1, "payment_type": 1}},
+        {"$project": {"_id": 0, "day": 1, "payment_type": 1, "orders": 1, "revenue": dollars("$revenue")}}
+    ], ["day", "payment_type", "orders", "revenue"]),
+    "orders": ("orders", "created_at", [
+        {"$sort": {"created_at": 1}},
+        {"$project": {
+            "_id": 0, "id": 1, "created_at": 1, "status": 1, "payment_type": 1,
+            "customer_name": 1, "customer_email": 1, "total": dollars("$total_amount"),
+            "items": {"$size": {"$ifNull": ["$items", []]}}
+        }}
+    ], ["id", "created_at", "status", "payment_type", "customer_name", "customer_email", "total", "items"]),
+    "products": ("orders", "created_at", [
+        {"$match": {"status": {"$in": REVENUE_STATUSES}}},
+        *product_sales_pipeline({})[1:],
+        {"$sort": {"revenue": -1}},
+        {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "quantity": 1, "revenue": dollars("$revenue")}}
+    ], ["product_id", "name", "quantity", "revenue"]),
+    "users": ("auth_users", "created_at", [
+        {"$sort": {"created_at": 1}},
+        {"$project": {
+            "_id": 0, "id": 1, "name": 1, "email": 1, "role": 1,
+            "membershipLevel": 1, "created_at": 1, "purchase_count": 1
+        }}
+    ], ["id", "name", "email", "role", "membershipLevel", "created_at", "purchase_count"]),
+    "appointments": ("appointments", "date", [
+        {"$sort": {"date": 1, "time": 1}},
+        {"$project": {
+            "_id": 0, "id": 1, "date": 1, "time": 1, "serviceName": 1, "clientName": 1,
+            "clientEmail": 1, "status": 1, "paymentStatus": 1, "totalAmount": 1
+        }}
+    ], ["id", "date", "time", "serviceName", "clientName", "clientEmail", "status", "paymentStatus", "totalAmount"]),
+}
+
+
+def csv_cell(value: Any) -> Any:
+    """Neutralise spreadsheet formulas in user-supplied text"""
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return "" if value is None else value
+
+
+async def stream_csv(cursor, columns: List[str]):
+    """Render cursor rows as CSV, yielding roughly 64KB at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for doc in cursor:
+        writer.writerow([csv_cell(doc.get(column)) for column in columns])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@api_router.get("/analytics/{report}/export.csv")
+async def export_analytics_csv(
+    report: str,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    current_admin: dict = Depends(get_current_admin_user)
+):
+    """Stream an analytics report as CSV (admin only)"""
+    if report not in EXPORT_REPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown report. Available: {', '.join(EXPORT_REPORTS)}")
+    collection, date_field, stages, columns = EXPORT_REPORTS[report]
+    date_from, date_to = parse_iso_param(date_from, "from"), parse_iso_param(date_to, "to")
+    
+    match = {date_field: date_range_filter(date_from, date_to)} if date_from or date_to else {}
+    cursor = db[collection].aggregate([{"$match": match}, *stages], allowDiskUse=True, batchSize=1000)
+    
+    # Only the parsed YYYY-MM-DD parts reach the header
+    filename = "-".join(part for part in (report, date_from and date_from[:10], date_to and date_to[:10]) if part)
+    return StreamingResponse(
+        stream_csv(cursor, columns),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+    )
+
+
+# ============= TIME-SERIES ANALYTICS =============
+
+# metric -> (collection, timestamp field, filter, summed field or None to count, scale)
+TIMESERIES_METRICS = {
+    "revenue": ("orders", "created_at", {"status": {"$in": REVENUE_STATUSES}}, "total_amount", 0.01),
+    "orders": ("orders", "created_at", {}, None, 1),
+    "signups": ("auth_users", "created_at", {}, None, 1),
+    "appointments": ("appointments", "created_at", {}, None, 1),
+    "emergencies": ("emergency_requests", "submittedAt", {}, None, 1),
+}
+
+# granularity -> (pandas frequency, default span, approximate bucket width)
+TIMESERIES_GRANULARITIES = {
+    "hour": ("h", timedelta(days=2), timedelta(hours=1)),
+    "day": ("D", timedelta(days=30), timedelta(days=1)),
+    "week": ("W-MON", timedelta(weeks=26), timedelta(weeks=1)),
+    "month": ("MS", timedelta(days=730), timedelta(days=28)),
+}
+MAX_TIMESERIES_BUCKETS = 20000
+
+
+def bucket_starts(index: pd.DatetimeIndex, granularity: str) -> pd.DatetimeIndex:
+    """Map naive local wall-clock times to the start of their bucket"""
+    if granularity == "hour":
+        return index.floor("h")
+    if granularity == "month":
+        return index.to_period("M").to_timestamp()
+    days = index.normalize()
+    if granularity == "week":
+        return days - pd.to_timedelta(days.weekday, unit="D")
+    return days
+
+
+def build_timeseries(
+    timestamps: List[str],
+    values: np.ndarray,
+    granularity: str,
+    tz: str,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    window: int
+) -> dict:
+    """Bucket raw events into a dense series with cumulative sums and a moving average"""
+    freq = TIMESERIES_GRANULARITIES[granularity][0]
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype="object"), utc=True, format="ISO8601", errors="coerce")
+    valid = parsed.notna().to_numpy()
+    
+    # Bucket on local wall-clock time so days and months follow the requested zone across DST
+    local = pd.DatetimeIndex(parsed[valid]).tz_convert(tz).tz_localize(None)
+    sums = pd.Series(values[valid], index=local).groupby(bucket_starts(local, granularity)).sum()
+    
+    bounds = bucket_starts(pd.DatetimeIndex([start, end]).tz_convert(tz).tz_localize(None), granularity)
+    buckets = pd.date_range(bounds[0], bounds[1], freq=freq)
+    dense = sums.reindex(buckets, fill_value=0).astype(float)
+    cumulative = dense.cumsum()
+    moving_average = dense.rolling(window=window, min_periods=1).mean()
+    
+    labels = buckets.tz_localize(tz, ambiguous=np.ones(len(buckets), dtype=bool), nonexistent="shift_forward")
+    return {
+        "points": [
+            {"t": t.isoformat(), "value": round(v, 2), "cumulative": round(c, 2), "movingAverage": round(m, 2)}
+            for t, v, c, m in zip(labels, dense.tolist(), cumulative.tolist(), moving_average.tolist())
+        ],
+        "total": round(float(dense.sum()), 2)
+    }
+
+
+@api_router.get("/analytics/timeseries")
+@cached_analytics(ttl=60, tags=("orders", "users", "appointments", "emergencies"))
+async def get_timeseries_analytics(
+    metric: str = "revenue",
+    granularity: str = "day",
+    tz: str = "UTC",
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    window: int = Query(7, gt=0, le=365)
+):
+    """Dense, gap-filled time series of a metric bucketed by hour, day, week or month"""
+    if metric not in TIMESERIES_METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid metric. Allowed: {', '.join(TIMESERIES_METRICS)}")
+    if granularity not in TIMESERIES_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid granularity. Allowed: {', '.join(TIMESERIES_GRANULARITIES)}")
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid time zone")
+    
+    try:
+        # Naive bounds are interpreted in the requested time zone
+        end = pd.Timestamp(date_to) if date_to else pd.Timestamp.now(tz="UTC")
+        end = end.tz_localize(tz) if end.tzinfo is None else end
+        start = pd.Timestamp(date_from) if date_from else end - TIMESERIES_GRANULARITIES[granularity][1]
+        start = start.tz_localize(tz) if start.tzinfo is None else start
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    if date_to and len(date_to) == 10:
+        # A bare YYYY-MM-DD end date includes that whole day
+        end = end + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    
+    if (end - start) / TIMESERIES_GRANULARITIES[granularity][2] > MAX_TIMESERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail="Range too large for this granularity")
+    
+    # Projection-only cursor: just the timestamp (and value) columns
+    collection, time_field, match, value_field, scale = TIMESERIES_METRICS[metric]
+    query = {
+        **match,
+        time_field: {
+            "$gte": start.tz_convert("UTC").isoformat(),
+            "$lte": end.tz_convert("UTC").isoformat()
+        }
+    }
+    projection = {"_id": 0, time_field: 1}
+    if value_field:
+        projection[value_field] = 1
+    timestamps = []
+    raw_values = []
+    async for doc in db[collection].find(query, projection).batch_size(5000):
+        timestamps.append(doc.get(time_field))
+        raw_values.append((doc.get(value_field) or 0) if value_field else 1)
+    values = np.asarray(raw_values, dtype=float) * scale
+    
+    series = await asyncio.to_thread(build_timeseries, timestamps, values, granularity, tz, start, end, window)
+    return {
+        "metric": metric,
+        "granularity": granularity,
+        "tz": tz,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        **series
+    }
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -2132,4 +4727,12 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in background_tasks:
+        task.cancel()
+    try:
+        await like_buffer.flush()
+    except Exception as e:
+        logger.error(f"Final like flush failed: {str(e)}")
+    client.close()
+    image_executor.shutdown(wait=False)
+    password_pool.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -141,7 +141,8 @@ export const PaymentForm = ({
             name: item.name,
             quantity: item.quantity || 1,
             price: Math.round(item.price * 100),
-            type: paymentType
+            type: paymentType,
+            productId: item.productId
           })),
           customerEmail,
           customerName
@@ -83,7 +83,7 @@ export const CommunityManagement = () => {
                   <TableCell className="font-medium">{post.authorName || post.author || 'Anonymous'}</TableCell>
                   <TableCell className="max-w-[300px] truncate">{post.content}</TableCell>
                   <TableCell>{post.likes || 0}</TableCell>
-                  <TableCell>{post.comments?.length || 0}</TableCell>
+                  <TableCell>{post.commentCount ?? post.comments?.length ?? 0}</TableCell>
                   <TableCell>{post.date ? new Date(post.date).toLocaleDateString() : '-'}</TableCell>
                   <TableCell className="text-right">
                     <Button variant="ghost" size="icon" onClick={() => handleDeletePost(post.id)} className="text-destructive hover:text-destructive">
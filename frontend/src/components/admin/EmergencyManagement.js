@@ -10,8 +10,14 @@ import { useAuth } from '@/context/AuthContext';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
 
+// Same triage order as the API: most urgent first, then longest waiting
+const URGENCY_RANKS = { critical: 0, high: 1, medium: 2, low: 3 };
+const byPriority = (a, b) =>
+  (URGENCY_RANKS[a.urgency] ?? 2) - (URGENCY_RANKS[b.urgency] ?? 2) ||
+  (a.submittedAt || '').localeCompare(b.submittedAt || '');
+
 export const EmergencyManagement = () => {
-  const { getAuthHeaders } = useAuth();
+  const { getAuthHeaders, token } = useAuth();
   const [emergencyRequests, setEmergencyRequests] = useState([]);
   const [selectedRequest, setSelectedRequest] = useState(null);
   const [showDetailsDialog, setShowDetailsDialog] = useState(false);
@@ -40,6 +46,27 @@ export const EmergencyManagement = () => {
     loadRequests();
   }, [loadRequests]);
 
+  // Live updates instead of polling; EventSource reconnects and resumes on its own
+  useEffect(() => {
+    if (!token) return undefined;
+    const source = new EventSource(`${API_URL}/api/admin/emergency/stream?token=${encodeURIComponent(token)}`);
+    source.addEventListener('emergency.created', (event) => {
+      const request = JSON.parse(event.data);
+      setEmergencyRequests((prev) => [...prev.filter((r) => r.id !== request.id), request].sort(byPriority));
+      toast.error(`New ${request.urgency} emergency request from ${request.name}`);
+    });
+    source.addEventListener('emergency.resolved', (event) => {
+      const { id, resolvedAt } = JSON.parse(event.data);
+      setEmergencyRequests((prev) => prev.map((r) => (r.id === id ? { ...r, status: 'resolved', resolvedAt } : r)));
+    });
+    source.addEventListener('emergency.deleted', (event) => {
+      const { id } = JSON.parse(event.data);
+      setEmergencyRequests((prev) => prev.filter((r) => r.id !== id));
+    });
+    source.addEventListener('reset', () => loadRequests());
+    return () => source.close();
+  }, [token, loadRequests]);
+
   const handleMarkResolved = async (id) => {
     try {
       const response = await fetch(`${API_URL}/api/emergency-requests/${id}/resolve`, {
@@ -194,6 +194,10 @@ export const AuthProvider = ({ children }) => {
         throw new Error(errorData.detail || 'Password change failed');
       }
       
+      // The old token is revoked by the change; switch to the new one
+      const data = await response.json();
+      setToken(data.access_token);
+      localStorage.setItem('authToken', data.access_token);
       return true;
     } catch (error) {
       console.error('Password change error:', error);
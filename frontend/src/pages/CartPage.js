@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useCart } from '@/context/CartContext';
 import { useAuth } from '@/context/AuthContext';
@@ -11,12 +11,33 @@ import { toast } from 'sonner';
 import { Minus, Plus, Trash2, ShoppingBag, CreditCard, ArrowLeft, Receipt } from 'lucide-react';
 import { PaymentForm } from '@/components/PaymentForm';
 
+const API_URL = process.env.REACT_APP_BACKEND_URL;
+
 export const CartPage = () => {
   const navigate = useNavigate();
   const { cart, removeFromCart, updateQuantity, getCartTotal, clearCart } = useCart();
   const { user } = useAuth();
   const { taxSettings, calculateTax, calculateTotal, formatTaxRate } = useSettings();
   const [showPayment, setShowPayment] = useState(false);
+  const [quote, setQuote] = useState(null);
+
+  // Server-side pricing is authoritative; the local calculation is only a fallback
+  useEffect(() => {
+    if (cart.length === 0) {
+      setQuote(null);
+      return;
+    }
+    let cancelled = false;
+    fetch(`${API_URL}/api/checkout/quote`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items: cart.map(item => ({ id: item.id, quantity: item.quantity })) })
+    })
+      .then(response => (response.ok ? response.json() : null))
+      .then(data => { if (!cancelled) setQuote(data); })
+      .catch(() => { if (!cancelled) setQuote(null); });
+    return () => { cancelled = true; };
+  }, [cart]);
 
   const handleCheckout = () => {
     if (!user) {
@@ -43,9 +64,9 @@ export const CartPage = () => {
     console.error('Payment failed:', error);
   };
 
-  const subtotal = getCartTotal();
-  const tax = calculateTax(subtotal);
-  const totalWithTax = calculateTotal(subtotal);
+  const subtotal = quote ? quote.subtotal / 100 : getCartTotal();
+  const tax = quote ? quote.tax / 100 : calculateTax(subtotal);
+  const totalWithTax = quote ? quote.total / 100 : calculateTotal(subtotal);
 
   if (cart.length === 0 && !showPayment) {
     return (
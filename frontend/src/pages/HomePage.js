@@ -31,11 +31,11 @@ export const HomePage = () => {
     // Load testimonials from community posts API (show first 3 with good content)
     const loadTestimonials = async () => {
       try {
-        const response = await fetch(`${API_URL}/api/community-posts`);
+        const response = await fetch(`${API_URL}/api/community-posts/feed?limit=3`);
         if (response.ok) {
-          const posts = await response.json();
+          const { posts } = await response.json();
           // Convert community posts to testimonial format
-          const testimonialPosts = posts.slice(0, 3).map(post => ({
+          const testimonialPosts = posts.map(post => ({
             name: post.authorName || 'Community Member',
             text: post.content,
             rating: 5,
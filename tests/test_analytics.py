@@ -0,0 +1,309 @@
+"""
+Test suite for analytics:
+- Revenue rollup rebuild and consistency
+- Product sales counters and date-range aggregation
+- Analytics response cache invalidation
+- Time-series API
+- Signup cohorts and retention
+- Streaming CSV exports
+- Daily analytics snapshots
+"""
+
+import pytest
+import requests
+import os
+import uuid
+import csv
+import io
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+# Test credentials
+ADMIN_EMAIL = "admin@mothernatural.com"
+ADMIN_PASSWORD = "Aniyah13"
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Headers with admin auth token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    assert response.status_code == 200, f"Admin login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+# ============= REVENUE ROLLUP TESTS =============
+
+class TestRevenueRollup:
+    """Tests for the revenue_daily rollup"""
+
+    def test_rebuild_requires_admin(self):
+        """Rebuilding the rollup is admin only"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/revenue/rebuild")
+        assert response.status_code == 401
+
+    def test_rebuild_matches_dashboard_total(self, auth_headers):
+        """After a rebuild the rollup total equals the dashboard's order total"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/revenue/rebuild", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["success"] == True
+
+        revenue = requests.get(f"{BASE_URL}/api/analytics/revenue", headers=auth_headers).json()
+        dashboard = requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers).json()
+        assert round(revenue["totalRevenue"], 2) == round(dashboard["overview"]["totalRevenue"], 2)
+
+    def test_revenue_series_sorted(self, auth_headers):
+        """Daily and monthly series are chronological and bounded"""
+        data = requests.get(f"{BASE_URL}/api/analytics/revenue", headers=auth_headers).json()
+        days = [d["date"] for d in data["daily"]]
+        months = [m["month"] for m in data["monthly"]]
+        assert days == sorted(days) and len(days) <= 30
+        assert months == sorted(months) and len(months) <= 12
+
+
+# ============= PRODUCT SALES TESTS =============
+
+class TestProductSales:
+    """Tests for per-product sales counters"""
+
+    def test_top_products_from_counters(self, auth_headers):
+        """Top sellers are sorted by revenue and capped at top"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/products/rebuild", headers=auth_headers)
+        assert response.status_code == 200
+        
+        data = requests.get(f"{BASE_URL}/api/analytics/products?top=5", headers=auth_headers).json()
+        revenues = [p["revenue"] for p in data["topSellingProducts"]]
+        assert len(revenues) <= 5
+        assert revenues == sorted(revenues, reverse=True)
+        assert data["totalProducts"] == sum(c["count"] for c in data["categoryBreakdown"])
+
+    def test_date_range_aggregation(self, auth_headers):
+        """A date range uses the aggregation fallback"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/products?from=2000-01-01&to=2000-01-31",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert response.json()["topSellingProducts"] == []
+
+
+# ============= ANALYTICS CACHE TESTS =============
+
+class TestAnalyticsCache:
+    """Tests for the cached analytics layer"""
+
+    def test_repeated_requests_consistent(self, auth_headers):
+        """Back-to-back requests return the same cached payload"""
+        first = requests.get(f"{BASE_URL}/api/analytics/classes", headers=auth_headers).json()
+        second = requests.get(f"{BASE_URL}/api/analytics/classes", headers=auth_headers).json()
+        assert first == second
+
+    def test_user_write_invalidates_dashboard(self, auth_headers):
+        """Registering a user is reflected in the next dashboard response"""
+        before = requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers).json()
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "name": "TEST_Cache User",
+            "email": f"test_cache_{uuid.uuid4().hex[:8]}@example.com",
+            "password": "testpass123"
+        })
+        assert response.status_code == 200
+        after = requests.get(f"{BASE_URL}/api/analytics/dashboard", headers=auth_headers).json()
+        assert after["overview"]["totalUsers"] == before["overview"]["totalUsers"] + 1
+
+
+# ============= TIME-SERIES TESTS =============
+
+class TestTimeseries:
+    """Tests for /api/analytics/timeseries"""
+
+    def test_daily_series_is_dense(self, auth_headers):
+        """Every day in the range has a point, even without data"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/timeseries?metric=revenue&granularity=day&from=2000-01-01&to=2000-01-31",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["points"]) == 31
+        assert all(p["value"] == 0 for p in data["points"])
+        assert data["total"] == 0
+
+    def test_time_zone_offsets(self, auth_headers):
+        """Buckets are aligned to the requested time zone"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/timeseries?metric=signups&granularity=month"
+            f"&tz=America/New_York&from=2000-01-01&to=2000-06-30",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        points = response.json()["points"]
+        assert len(points) == 6
+        assert points[0]["t"].startswith("2000-01-01T00:00:00-05:00")
+        assert points[5]["t"].startswith("2000-06-01T00:00:00-04:00")
+
+    def test_cumulative_matches_total(self, auth_headers):
+        """The last cumulative value equals the series total"""
+        data = requests.get(
+            f"{BASE_URL}/api/analytics/timeseries?metric=orders&granularity=week",
+            headers=auth_headers
+        ).json()
+        assert data["points"][-1]["cumulative"] == data["total"]
+
+    def test_invalid_parameters(self, auth_headers):
+        """Unknown metrics, granularities and zones are rejected"""
+        for query in ("metric=nope", "granularity=minute", "tz=Mars/Olympus", "from=garbage"):
+            response = requests.get(f"{BASE_URL}/api/analytics/timeseries?{query}", headers=auth_headers)
+            assert response.status_code == 400, query
+
+    def test_too_many_buckets(self, auth_headers):
+        """Hourly series over decades are refused"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/timeseries?granularity=hour&from=1990-01-01&to=2020-01-01",
+            headers=auth_headers
+        )
+        assert response.status_code == 400
+
+
+# ============= COHORT TESTS =============
+
+class TestCohorts:
+    """Tests for signup cohort retention analytics"""
+
+    def test_rebuild_and_read(self, auth_headers):
+        """Cohorts can be rebuilt and read back as a retention grid"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/cohorts/rebuild", headers=auth_headers)
+        assert response.status_code == 200
+        
+        data = requests.get(f"{BASE_URL}/api/analytics/cohorts?months=6", headers=auth_headers).json()
+        assert len(data["cohorts"]) <= 6
+        cohorts = [c["cohort"] for c in data["cohorts"]]
+        assert cohorts == sorted(cohorts)
+        for cohort in data["cohorts"]:
+            assert len(cohort["active"]) == len(cohort["retention"])
+            assert all(0 <= r <= 100 for r in cohort["retention"])
+            assert cohort["repeatPurchasers"] <= cohort["purchasers"]
+
+    def test_deleted_user_leaves_cohort(self, auth_headers):
+        """Deleting a user takes them back out of their signup cohort"""
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "name": "TEST Cohort User",
+            "email": f"TEST_cohort_{uuid.uuid4().hex[:8]}@example.com",
+            "password": "testpassword123"
+        })
+        assert response.status_code == 200
+        user_id = response.json()["user"]["id"]
+        before = requests.get(f"{BASE_URL}/api/analytics/cohorts?months=1", headers=auth_headers).json()["cohorts"][0]
+
+        response = requests.delete(f"{BASE_URL}/api/admin/users/{user_id}", headers=auth_headers)
+        assert response.status_code == 200
+        after = requests.get(f"{BASE_URL}/api/analytics/cohorts?months=1", headers=auth_headers).json()["cohorts"][0]
+        assert after["cohort"] == before["cohort"]
+        assert after["size"] == before["size"] - 1
+        assert all(a <= b for a, b in zip(after["active"], before["active"]))
+
+    def test_user_analytics_totals(self, auth_headers):
+        """Role breakdown adds up to the total user count"""
+        data = requests.get(f"{BASE_URL}/api/analytics/users", headers=auth_headers).json()
+        assert sum(data["roleBreakdown"].values()) == data["totalUsers"]
+        assert len(data["dailySignups"]) <= 30
+
+
+# ============= CSV EXPORT TESTS =============
+
+class TestCsvExports:
+    """Tests for /api/analytics/{report}/export.csv"""
+
+    @pytest.mark.parametrize("report", ["revenue", "orders", "products", "users", "appointments"])
+    def test_export_has_header(self, auth_headers, report):
+        """Every report streams a CSV with a header row"""
+        response = requests.get(f"{BASE_URL}/api/analytics/{report}/export.csv", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers.get("content-type", "").startswith("text/csv")
+        assert "attachment" in response.headers.get("content-disposition", "")
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert len(rows) >= 1
+
+    def test_date_range_filters_rows(self, auth_headers):
+        """A range with no data yields only the header"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/orders/export.csv?from=2000-01-01&to=2000-01-02",
+            headers=auth_headers
+        )
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows == [["id", "created_at", "status", "payment_type", "customer_name", "customer_email", "total", "items"]]
+
+    def test_invalid_dates_rejected(self, auth_headers):
+        """Date bounds must parse; raw values never reach the filename"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/orders/export.csv?from=2000-01-01%22%0d%0aX-Injected:%201",
+            headers=auth_headers
+        )
+        assert response.status_code == 400
+        assert "x-injected" not in response.headers
+
+    def test_filename_from_parsed_dates(self, auth_headers):
+        """The attachment name is built from the parsed dates"""
+        response = requests.get(
+            f"{BASE_URL}/api/analytics/orders/export.csv?from=2000-01-01T00:00:00&to=2000-01-02",
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert 'filename="orders-2000-01-01-2000-01-02.csv"' in response.headers["content-disposition"]
+
+    def test_unknown_report(self, auth_headers):
+        """Unknown reports return 404"""
+        response = requests.get(f"{BASE_URL}/api/analytics/nope/export.csv", headers=auth_headers)
+        assert response.status_code == 404
+
+    def test_export_requires_admin(self):
+        """Exports contain customer data and are admin only"""
+        response = requests.get(f"{BASE_URL}/api/analytics/users/export.csv")
+        assert response.status_code == 401
+
+
+# ============= SNAPSHOT TESTS =============
+
+class TestAnalyticsSnapshots:
+    """Tests for daily analytics snapshots"""
+
+    def test_take_and_read_snapshot(self, auth_headers):
+        """A manual snapshot is readable by date"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/snapshots", headers=auth_headers)
+        assert response.status_code == 200
+        date = response.json()["date"]
+        
+        snapshots = requests.get(f"{BASE_URL}/api/analytics/snapshots?from={date}&to={date}").json()
+        assert len(snapshots) == 1
+        snapshot = snapshots[0]
+        assert snapshot["date"] == date
+        for section in ("overview", "appointments", "retreats", "fundraisers"):
+            assert section in snapshot
+
+    def test_fields_projection(self, auth_headers):
+        """`fields` limits the returned sections"""
+        requests.post(f"{BASE_URL}/api/admin/analytics/snapshots", headers=auth_headers)
+        snapshots = requests.get(f"{BASE_URL}/api/analytics/snapshots?fields=retreats").json()
+        assert snapshots
+        assert set(snapshots[-1].keys()) == {"date", "retreats"}
+
+    def test_overlapping_fields(self, auth_headers):
+        """A section listed with one of its sub-paths returns the whole section"""
+        requests.post(f"{BASE_URL}/api/admin/analytics/snapshots", headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/analytics/snapshots?fields=retreats.items,retreats,date")
+        assert response.status_code == 200, response.text
+        snapshot = response.json()[-1]
+        assert set(snapshot.keys()) == {"date", "retreats"}
+        assert "capacity" in snapshot["retreats"]
+
+    def test_unknown_fields_rejected(self):
+        """Only snapshot sections can be projected; _id never reaches the response"""
+        for fields in ("_id", "overview,_id", "nope"):
+            response = requests.get(f"{BASE_URL}/api/analytics/snapshots?fields={fields}")
+            assert response.status_code == 400, fields
+
+    def test_snapshot_requires_admin(self):
+        """Taking a snapshot manually is admin only"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/snapshots")
+        assert response.status_code == 401
@@ -7,12 +7,16 @@ import pytest
 import requests
 import os
 import uuid
+from datetime import datetime, timedelta, timezone
+
+from jose import jwt
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 
 # Admin credentials
 ADMIN_EMAIL = "admin@mothernatural.com"
 ADMIN_PASSWORD = "Aniyah13"
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'mother-natural-secret-key-change-in-production-2025')
 
 
 class TestAuthLogin:
@@ -185,6 +189,52 @@ class TestAdminUsers:
         
         print(f"✓ Admin get all users successful - found {len(data)} users")
     
+    def test_user_directory_prefix_search(self, admin_token):
+        """A query containing @ is a case-insensitive email prefix search"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/users/directory?q=ADMIN@mother", headers=headers)
+        
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        emails = [u["email"] for u in response.json()["users"]]
+        assert ADMIN_EMAIL in emails
+        assert all(e.lower().startswith("admin@mother") for e in emails)
+        print("✓ Directory prefix search successful")
+    
+    def test_user_directory_name_search(self, admin_token):
+        """searchBy=name matches name prefixes only and pages in name order"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        data = requests.get(f"{BASE_URL}/api/admin/users/directory?q=admin&searchBy=name&limit=1", headers=headers).json()
+        assert all(u["name"].lower().startswith("admin") for u in data["users"])
+        
+        if data["nextCursor"]:
+            # Cursors are tied to the field they were issued for
+            response = requests.get(
+                f"{BASE_URL}/api/admin/users/directory?q=admin@&searchBy=email&cursor={data['nextCursor']}",
+                headers=headers
+            )
+            assert response.status_code == 400
+        print("✓ Directory name search successful")
+    
+    def test_user_directory_pagination(self, admin_token):
+        """Keyset pages are ordered by name with no repeats"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        seen, cursor = [], None
+        for _ in range(3):
+            url = f"{BASE_URL}/api/admin/users/directory?limit=2&role=user" + (f"&cursor={cursor}" if cursor else "")
+            data = requests.get(url, headers=headers).json()
+            assert len(data["users"]) <= 2
+            assert all(u["role"] == "user" for u in data["users"])
+            seen.extend(data["users"])
+            cursor = data["nextCursor"]
+            if not cursor:
+                break
+        
+        ids = [u["id"] for u in seen]
+        names = [u["name"].lower() for u in seen]
+        assert len(set(ids)) == len(ids)
+        assert names == sorted(names)
+        print(f"✓ Directory pagination returned {len(seen)} users")
+    
     def test_get_all_users_without_token(self):
         """Test getting users without token returns 401"""
         response = requests.get(f"{BASE_URL}/api/admin/users")
@@ -243,6 +293,84 @@ class TestAdminUsers:
         
         print(f"✓ Admin created user successfully - email: {unique_email}")
 
+    def test_role_change_revokes_token(self, admin_token):
+        """A demoted admin's existing token stops working for admin endpoints"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        unique_email = f"TEST_promoted_{uuid.uuid4().hex[:8]}@example.com"
+        created = requests.post(f"{BASE_URL}/api/admin/users", headers=headers, json={
+            "name": "Promoted User",
+            "email": unique_email,
+            "password": "promotedpass123",
+            "role": "admin",
+            "membershipLevel": "basic"
+        }).json()
+
+        login = requests.post(f"{BASE_URL}/api/auth/login", json={"email": unique_email, "password": "promotedpass123"})
+        user_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        assert requests.get(f"{BASE_URL}/api/admin/users", headers=user_headers).status_code == 200
+
+        response = requests.put(f"{BASE_URL}/api/admin/users/{created['id']}", headers=headers, json={"role": "user"})
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/admin/users", headers=user_headers)
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+        print("✓ Role change revoked the old token")
+
+    def test_deactivation_revokes_token(self, admin_token):
+        """A deactivated admin's existing token stops working for admin endpoints"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        unique_email = f"TEST_deactivated_{uuid.uuid4().hex[:8]}@example.com"
+        created = requests.post(f"{BASE_URL}/api/admin/users", headers=headers, json={
+            "name": "Deactivated Admin",
+            "email": unique_email,
+            "password": "deactivated123",
+            "role": "admin",
+            "membershipLevel": "basic"
+        }).json()
+
+        login = requests.post(f"{BASE_URL}/api/auth/login", json={"email": unique_email, "password": "deactivated123"})
+        user_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        assert requests.get(f"{BASE_URL}/api/admin/users", headers=user_headers).status_code == 200
+
+        response = requests.put(f"{BASE_URL}/api/admin/users/{created['id']}", headers=headers, json={"is_active": False})
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/admin/users", headers=user_headers)
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+        print("✓ Deactivation revoked the old token")
+
+    def test_password_change_revokes_old_token(self):
+        """Changing your own password revokes earlier tokens and returns a fresh one"""
+        unique_email = f"TEST_pwchange_{uuid.uuid4().hex[:8]}@example.com"
+        old_token = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "name": "Password Changer",
+            "email": unique_email,
+            "password": "oldpassword123"
+        }).json()["access_token"]
+
+        response = requests.put(
+            f"{BASE_URL}/api/auth/change-password",
+            headers={"Authorization": f"Bearer {old_token}"},
+            json={"current_password": "oldpassword123", "new_password": "newpassword123"}
+        )
+        assert response.status_code == 200, response.text
+        new_token = response.json()["access_token"]
+
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {old_token}"}).status_code == 401
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {new_token}"}).status_code == 200
+        print("✓ Password change revoked the old token")
+
+    def test_legacy_email_only_token_accepted(self):
+        """Tokens issued before claims were added still authorize admins"""
+        token = jwt.encode(
+            {"sub": ADMIN_EMAIL, "exp": datetime.now(timezone.utc) + timedelta(minutes=5)},
+            JWT_SECRET_KEY,
+            algorithm="HS256"
+        )
+        response = requests.get(f"{BASE_URL}/api/admin/users", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        print("✓ Legacy email-only token accepted")
+
 
 class TestProductsCRUD:
     """Test /api/products CRUD endpoints"""
@@ -496,6 +624,95 @@ class TestFundraisersCRUD:
         print("✓ Fundraiser CRUD cycle successful")
 
 
+class TestUserSync:
+    """Test /api/users/sync bulk upsert"""
+    
+    def test_sync_collapses_duplicates(self):
+        """Duplicate emails are collapsed and counts are reported"""
+        tag = uuid.uuid4().hex[:8]
+        users = [
+            {"id": f"sync-{tag}-{i}", "name": f"TEST_Sync {i}", "email": f"test_sync_{tag}_{i}@example.com"}
+            for i in range(50)
+        ]
+        users.append({**users[0], "name": "TEST_Sync renamed"})
+        
+        response = requests.post(f"{BASE_URL}/api/users/sync", json=users)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["received"] == 51
+        assert data["duplicates"] == 1
+        assert data["inserted"] == 50
+        assert data["failed"] == 0
+        
+        # Re-syncing the same users modifies rather than inserts
+        data = requests.post(f"{BASE_URL}/api/users/sync", json=users[:10]).json()
+        assert data["inserted"] == 0
+        assert data["modified"] == 10
+        print("✓ User sync bulk upsert successful")
+
+
+class TestBulkUserImport:
+    """Test /api/admin/users/import"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+        )
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    def test_csv_import(self, admin_headers):
+        """Valid rows are created; invalid, duplicate and existing rows are reported"""
+        tag = uuid.uuid4().hex[:8]
+        rows = [f"TEST_Import {i},test_import_{tag}_{i}@example.com,pass{i}word,user,basic" for i in range(5)]
+        rows.append(f"TEST_Import dup,test_import_{tag}_0@example.com,password,user,basic")
+        rows.append("TEST_Import bad,not-an-email,password,user,basic")
+        rows.append(f"TEST_Import admin,{ADMIN_EMAIL.upper()},password,user,basic")
+        csv_data = "name,email,password,role,membershipLevel\n" + "\n".join(rows)
+        
+        files = {"file": ("members.csv", csv_data.encode(), "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/admin/users/import", files=files, headers=admin_headers)
+        assert response.status_code == 200, response.text
+        job_id = response.json()["jobId"]
+        
+        # Stream progress until the job finishes
+        url = f"{BASE_URL}/api/admin/users/import/{job_id}/stream"
+        with requests.get(url, headers=admin_headers, stream=True, timeout=60) as stream:
+            for line in stream.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:") and '"status": "completed"' in line:
+                    break
+        
+        job = requests.get(f"{BASE_URL}/api/admin/users/import/{job_id}", headers=admin_headers).json()
+        assert job["status"] == "completed"
+        assert job["inserted"] == 5
+        assert job["duplicates"] == 1
+        assert job["invalid"] == 1
+        assert job["existing"] == 1
+        
+        login = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": f"test_import_{tag}_3@example.com", "password": "pass3word"
+        })
+        assert login.status_code == 200
+        print("✓ Bulk CSV import successful")
+    
+    def test_register_rejects_case_variant(self):
+        """An email differing only by case cannot create a second account"""
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "name": "Case Variant",
+            "email": ADMIN_EMAIL.upper(),
+            "password": "testpassword123"
+        })
+        assert response.status_code == 400
+        assert "already registered" in response.json()["detail"].lower()
+    
+    def test_import_requires_admin(self):
+        """Import is admin only"""
+        files = {"file": ("members.csv", b"name,email,password\n", "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/admin/users/import", files=files)
+        assert response.status_code == 401
+
+
 class TestSenderEmailConfig:
     """Test that SENDER_EMAIL is configured correctly"""
     
@@ -0,0 +1,84 @@
+"""
+Unit tests for InvalidationBus.receive():
+- Messages from this worker are skipped
+- Unsupported schema versions are skipped
+- Handlers are dispatched with the message keys
+- Late (out-of-order) messages are still applied and counted
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from cache_bus import InvalidationBus
+
+
+class RecordingCache:
+    """Stands in for a local cache; remembers what it was told to drop"""
+
+    def __init__(self):
+        self.dropped = []
+
+    def invalidate(self, *keys):
+        self.dropped.append(keys)
+
+
+def make_bus():
+    cache = RecordingCache()
+    bus = InvalidationBus(db=None)
+    bus.register("analytics", cache.invalidate)
+    return bus, cache
+
+
+def message(**fields):
+    return {
+        "v": InvalidationBus.VERSION,
+        "cache": "analytics",
+        "keys": ["users"],
+        "origin": "other-worker",
+        "seq": 1,
+        "ts": datetime.now(timezone.utc),
+        **fields
+    }
+
+
+class TestInvalidationBusReceive:
+    """Tests for applying broadcast invalidations"""
+
+    def test_dispatches_to_handler(self):
+        """A message from another worker drops its keys from the named cache"""
+        bus, cache = make_bus()
+        assert bus.receive(message(keys=["users", "orders"])) == True
+        assert cache.dropped == [("users", "orders")]
+        assert bus.stats()["received"] == 1
+        assert bus.stats()["lastLagMs"] is not None
+
+    def test_skips_own_messages(self):
+        """A worker has already applied its own invalidations locally"""
+        bus, cache = make_bus()
+        assert bus.receive(message(origin=bus.worker_id)) == False
+        assert bus.receive(message(origin=None)) == False
+        assert cache.dropped == []
+
+    def test_skips_unsupported_version(self):
+        """Messages from a newer schema are ignored"""
+        bus, cache = make_bus()
+        assert bus.receive(message(v=InvalidationBus.VERSION + 1)) == False
+        assert cache.dropped == []
+
+    def test_skips_unknown_cache(self):
+        """Caches this worker never registered are ignored"""
+        bus, cache = make_bus()
+        assert bus.receive(message(cache="nope")) == False
+        assert bus.stats()["received"] == 0
+
+    def test_late_messages_still_applied(self):
+        """Out-of-order messages are applied, since dropping entries twice is harmless"""
+        bus, cache = make_bus()
+        bus.receive(message(seq=5, keys=["a"]))
+        bus.receive(message(seq=3, keys=["b"]))
+        bus.receive(message(seq=3, origin="third-worker", keys=["c"]))
+        assert cache.dropped == [("a",), ("b",), ("c",)]
+        assert bus.stats()["outOfOrder"] == 1
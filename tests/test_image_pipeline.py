@@ -0,0 +1,271 @@
+"""
+Test suite for the image pipeline:
+- Responsive variants (/api/images/{filename}?w=&fmt=)
+- Content-addressed deduplication of uploads
+- Streaming size cap and magic byte validation
+- Hot image cache metrics and cross-worker invalidation
+- Orphaned image garbage collection
+"""
+
+import pytest
+import requests
+import os
+import io
+from PIL import Image
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+# Test credentials
+ADMIN_EMAIL = "admin@mothernatural.com"
+ADMIN_PASSWORD = "Aniyah13"
+
+
+def make_png(width=1000, height=500, color=(167, 139, 250)):
+    """Build an in-memory PNG of the given size"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def admin_headers():
+    """Headers with admin auth token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    assert response.status_code == 200, f"Admin login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def uploaded_image():
+    """Upload a test image and clean it up afterwards"""
+    files = {'file': ('TEST_variant.png', io.BytesIO(make_png()), 'image/png')}
+    response = requests.post(f"{BASE_URL}/api/upload/image", files=files)
+    assert response.status_code == 200, f"Upload failed: {response.text}"
+    filename = response.json()["filename"]
+    yield filename
+    requests.delete(f"{BASE_URL}/api/images/{filename}")
+
+
+# ============= IMAGE VARIANT TESTS =============
+
+class TestImageVariants:
+    """Tests for resized/re-encoded image variants"""
+
+    def test_original_unchanged_without_params(self, uploaded_image):
+        """Without ?w= the original bytes are served"""
+        response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}")
+        assert response.status_code == 200
+        assert response.headers.get("content-type") == "image/png"
+        assert Image.open(io.BytesIO(response.content)).size == (1000, 500)
+
+    def test_webp_variant(self, uploaded_image):
+        """?w=400&fmt=webp returns a 400px wide WebP"""
+        response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}?w=400&fmt=webp")
+        assert response.status_code == 200
+        assert response.headers.get("content-type") == "image/webp"
+        assert Image.open(io.BytesIO(response.content)).size == (400, 200)
+
+    def test_width_snaps_to_configured_size(self, uploaded_image):
+        """Arbitrary widths are rounded up to the next variant width"""
+        response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}?w=150&fmt=jpeg")
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).size == (200, 100)
+
+    def test_accept_header_negotiation(self, uploaded_image):
+        """Browsers advertising WebP get WebP and a Vary header"""
+        response = requests.get(
+            f"{BASE_URL}/api/images/{uploaded_image}?w=200",
+            headers={"Accept": "image/webp,image/*"}
+        )
+        assert response.status_code == 200
+        assert response.headers.get("content-type") == "image/webp"
+        assert "Accept" in response.headers.get("vary", "")
+
+    def test_no_upscaling(self, uploaded_image):
+        """Variants wider than the original keep the original size"""
+        response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}?w=1200&fmt=png")
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).size == (1000, 500)
+
+    def test_invalid_format(self, uploaded_image):
+        """Unknown formats are rejected"""
+        response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}?w=200&fmt=bmp")
+        assert response.status_code == 400
+
+    def test_variant_of_missing_image(self):
+        """Variants of missing images return 404"""
+        response = requests.get(f"{BASE_URL}/api/images/nonexistent.png?w=200")
+        assert response.status_code == 404
+
+
+# ============= DEDUPLICATION TESTS =============
+
+class TestImageDeduplication:
+    """Tests for content-hash addressed uploads with reference counting"""
+
+    def upload(self, data, name='TEST_dedupe.png'):
+        files = {'file': (name, io.BytesIO(data), 'image/png')}
+        response = requests.post(f"{BASE_URL}/api/upload/image", files=files)
+        assert response.status_code == 200, f"Upload failed: {response.text}"
+        return response.json()
+
+    def test_duplicate_upload_returns_existing_url(self):
+        """Uploading the same bytes twice returns the same filename"""
+        data = make_png(64, 64, (240, 171, 252))
+        first = self.upload(data)
+        second = self.upload(data, name='TEST_dedupe_copy.png')
+        
+        assert first["duplicate"] == False
+        assert second["duplicate"] == True
+        assert second["url"] == first["url"]
+        
+        # Two references: the first delete keeps the file
+        requests.delete(f"{BASE_URL}/api/images/{first['filename']}")
+        response = requests.get(f"{BASE_URL}/api/images/{first['filename']}")
+        assert response.status_code == 200
+        
+        # The last reference removes it
+        requests.delete(f"{BASE_URL}/api/images/{first['filename']}")
+        response = requests.get(f"{BASE_URL}/api/images/{first['filename']}")
+        assert response.status_code == 404
+
+    def test_different_content_different_files(self):
+        """Different bytes are stored separately"""
+        first = self.upload(make_png(32, 32, (1, 2, 3)))
+        second = self.upload(make_png(32, 32, (4, 5, 6)))
+        assert first["filename"] != second["filename"]
+        for item in (first, second):
+            requests.delete(f"{BASE_URL}/api/images/{item['filename']}")
+
+
+# ============= STREAMING UPLOAD VALIDATION TESTS =============
+
+class TestStreamingUploadValidation:
+    """Tests for chunked upload validation"""
+
+    def test_spoofed_content_type_rejected(self):
+        """Non-image bytes declared as image/png are rejected by magic bytes"""
+        files = {'file': ('TEST_fake.png', io.BytesIO(b'Hello World' * 100), 'image/png')}
+        response = requests.post(f"{BASE_URL}/api/upload/image", files=files)
+        assert response.status_code == 400
+
+    def test_oversized_upload_rejected(self):
+        """Uploads over 5MB are rejected"""
+        data = make_png(8, 8) + os.urandom(5 * 1024 * 1024)
+        files = {'file': ('TEST_huge.png', io.BytesIO(data), 'image/png')}
+        response = requests.post(f"{BASE_URL}/api/upload/image", files=files)
+        assert response.status_code == 400
+        assert "too large" in response.json()["detail"]
+
+    def test_oversized_chunked_upload_rejected(self):
+        """Bodies without a Content-Length are capped while they are read"""
+        data = make_png(8, 8) + os.urandom(5 * 1024 * 1024 + 128 * 1024)
+        body, content_type = requests.models.RequestEncodingMixin._encode_files(
+            {'file': ('TEST_chunked.png', data, 'image/png')}, {}
+        )
+        chunks = (body[i:i + 65536] for i in range(0, len(body), 65536))
+        response = requests.post(
+            f"{BASE_URL}/api/upload/image",
+            data=chunks,
+            headers={"Content-Type": content_type}
+        )
+        assert response.status_code == 400
+        assert "too large" in response.json()["detail"]
+
+    def test_detected_type_is_stored(self):
+        """The sniffed type, not the declared one, is stored"""
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), (10, 20, 30)).save(buffer, format="JPEG")
+        files = {'file': ('TEST_mislabeled.png', io.BytesIO(buffer.getvalue()), 'image/png')}
+        response = requests.post(f"{BASE_URL}/api/upload/image", files=files)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["content_type"] == "image/jpeg"
+        assert data["filename"].endswith(".jpg")
+        requests.delete(f"{BASE_URL}/api/images/{data['filename']}")
+
+
+# ============= HOT IMAGE CACHE TESTS =============
+
+class TestHotImageCache:
+    """Tests for the in-memory image cache"""
+
+    def test_repeated_requests_hit_cache(self, uploaded_image, admin_headers):
+        """A hot image is served from memory after admission"""
+        before = requests.get(f"{BASE_URL}/api/admin/image-cache", headers=admin_headers).json()
+        for _ in range(4):
+            response = requests.get(f"{BASE_URL}/api/images/{uploaded_image}?w=200&fmt=webp")
+            assert response.status_code == 200
+            assert response.headers.get("content-type") == "image/webp"
+        after = requests.get(f"{BASE_URL}/api/admin/image-cache", headers=admin_headers).json()
+        
+        # Single worker assumption: at least the last two requests were hits
+        assert after["hits"] - before["hits"] >= 2
+        assert 0 <= after["hitRatio"] <= 1
+        assert after["bytes"] <= after["maxBytes"]
+
+    def test_invalidations_are_broadcast(self, admin_headers):
+        """Deleting an image publishes an invalidation for the other workers"""
+        before = requests.get(f"{BASE_URL}/api/admin/cache-bus", headers=admin_headers).json()
+        assert "image" in before["caches"] and "analytics" in before["caches"]
+        
+        files = {'file': ('TEST_bus.png', io.BytesIO(make_png(40, 40, (21, 22, 23))), 'image/png')}
+        filename = requests.post(f"{BASE_URL}/api/upload/image", files=files).json()["filename"]
+        requests.delete(f"{BASE_URL}/api/images/{filename}")
+        
+        # Single worker assumption: the same worker served both stats requests
+        after = requests.get(f"{BASE_URL}/api/admin/cache-bus", headers=admin_headers).json()
+        assert after["workerId"] == before["workerId"]
+        assert after["published"] > before["published"]
+    
+    def test_cache_stats_require_admin(self):
+        """Cache metrics are admin only"""
+        response = requests.get(f"{BASE_URL}/api/admin/image-cache")
+        assert response.status_code == 401
+
+    def test_deleted_image_not_served_from_cache(self):
+        """delete_image invalidates cached entries"""
+        files = {'file': ('TEST_cache.png', io.BytesIO(make_png(48, 48, (7, 8, 9))), 'image/png')}
+        filename = requests.post(f"{BASE_URL}/api/upload/image", files=files).json()["filename"]
+        for _ in range(3):
+            assert requests.get(f"{BASE_URL}/api/images/{filename}").status_code == 200
+        
+        requests.delete(f"{BASE_URL}/api/images/{filename}")
+        response = requests.get(f"{BASE_URL}/api/images/{filename}")
+        assert response.status_code == 404
+
+
+# ============= IMAGE GC TESTS =============
+
+class TestImageGarbageCollection:
+    """Tests for the orphaned image collector"""
+
+    def test_dry_run_report(self, admin_headers):
+        """A dry run reports orphans without deleting anything"""
+        response = requests.post(f"{BASE_URL}/api/admin/images/gc?dry_run=true", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["dryRun"] == True
+        for key in ("referencedImages", "orphanedImages", "orphanedBytes", "sample"):
+            assert key in data
+
+    def test_recent_uploads_survive_gc(self, admin_headers):
+        """Unreferenced uploads inside the grace period are kept"""
+        files = {'file': ('TEST_gc.png', io.BytesIO(make_png(24, 24, (11, 12, 13))), 'image/png')}
+        filename = requests.post(f"{BASE_URL}/api/upload/image", files=files).json()["filename"]
+        
+        response = requests.post(
+            f"{BASE_URL}/api/admin/images/gc?dry_run=false&grace_hours=1",
+            headers=admin_headers
+        )
+        assert response.status_code == 200
+        assert requests.get(f"{BASE_URL}/api/images/{filename}").status_code == 200
+        requests.delete(f"{BASE_URL}/api/images/{filename}")
+
+    def test_gc_requires_admin(self):
+        """GC is admin only"""
+        response = requests.post(f"{BASE_URL}/api/admin/images/gc")
+        assert response.status_code == 401
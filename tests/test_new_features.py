@@ -159,6 +159,40 @@ class TestEmergencyRequestsAPI:
         assert isinstance(data, list)
         print(f"Retrieved {len(data)} emergency requests")
     
+    def test_priority_order_and_pending_filter(self, api_client):
+        """Requests come back most urgent first; status=pending excludes resolved ones"""
+        created = []
+        for urgency in ("low", "critical", "medium"):
+            response = api_client.post(f"{BASE_URL}/api/emergency-requests", json={
+                "name": "TEST_Priority", "crisisType": "other", "urgency": urgency, "description": "Priority test"
+            })
+            created.append(response.json()["id"])
+        
+        ranks = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+        data = api_client.get(f"{BASE_URL}/api/emergency-requests?status=pending").json()
+        assert all(r["status"] == "pending" for r in data)
+        keys = [(ranks.get(r["urgency"], 2), r["submittedAt"]) for r in data]
+        assert keys == sorted(keys)
+        
+        for request_id in created:
+            api_client.delete(f"{BASE_URL}/api/emergency-requests/{request_id}")
+    
+    def test_emergency_stream(self, api_client, admin_token):
+        """Admins are pushed new requests; anonymous clients are refused"""
+        assert requests.get(f"{BASE_URL}/api/admin/emergency/stream", timeout=10).status_code == 401
+        
+        url = f"{BASE_URL}/api/admin/emergency/stream?token={admin_token}"
+        with requests.get(url, stream=True, timeout=10) as stream:
+            assert stream.status_code == 200
+            created = api_client.post(f"{BASE_URL}/api/emergency-requests", json={
+                "name": "TEST_Stream", "crisisType": "other", "urgency": "high", "description": "Stream test"
+            }).json()
+            events = read_sse_events(stream, 1)
+        
+        assert events[0]["event"] == "emergency.created"
+        assert created["id"] in events[0]["data"]
+        api_client.delete(f"{BASE_URL}/api/emergency-requests/{created['id']}")
+    
     def test_resolve_emergency_request(self, api_client):
         """Test resolving an emergency request"""
         if not hasattr(TestEmergencyRequestsAPI, 'created_id'):
@@ -221,19 +255,77 @@ class TestCommunityPostsAPI:
         assert isinstance(data, list)
         print(f"Retrieved {len(data)} community posts")
     
-    def test_like_community_post(self, api_client):
+    def test_feed_pagination(self, api_client):
+        """The feed pages newest first without gaps or repeats"""
+        seen = []
+        cursor = None
+        for _ in range(3):
+            url = f"{BASE_URL}/api/community-posts/feed?limit=2" + (f"&cursor={cursor}" if cursor else "")
+            response = api_client.get(url)
+            assert response.status_code == 200
+            data = response.json()
+            assert len(data["posts"]) <= 2
+            seen.extend(data["posts"])
+            cursor = data["nextCursor"]
+            if not cursor:
+                break
+        
+        keys = [(p["date"], p["id"]) for p in seen]
+        assert keys == sorted(keys, reverse=True)
+        assert len(set(keys)) == len(keys)
+    
+    def test_feed_author_filter(self, api_client):
+        """authorId limits the feed to one author"""
+        response = api_client.get(f"{BASE_URL}/api/community-posts/feed?authorId=test-author-123")
+        assert response.status_code == 200
+        posts = response.json()["posts"]
+        assert posts
+        assert all(p["authorId"] == "test-author-123" for p in posts)
+    
+    def test_feed_invalid_cursor(self, api_client):
+        """Malformed cursors are rejected"""
+        response = api_client.get(f"{BASE_URL}/api/community-posts/feed?cursor=not-a-cursor")
+        assert response.status_code == 400
+    
+    def test_like_community_post(self, api_client, auth_headers):
         """Test liking a community post"""
         if not hasattr(TestCommunityPostsAPI, 'created_id'):
             pytest.skip("No community post to like")
         
         post_id = TestCommunityPostsAPI.created_id
-        response = api_client.post(f"{BASE_URL}/api/community-posts/{post_id}/like")
+        response = api_client.post(f"{BASE_URL}/api/community-posts/{post_id}/like", headers=auth_headers)
         
         assert response.status_code == 200
         data = response.json()
         assert data.get("success") == True
+        assert data["likes"] == 1
         print(f"Community post liked: {post_id}")
     
+    def test_like_once_per_user(self, api_client, auth_headers):
+        """Repeat likes from the same user are ignored; unlike removes the like"""
+        if not hasattr(TestCommunityPostsAPI, 'created_id'):
+            pytest.skip("No community post to like")
+        
+        post_id = TestCommunityPostsAPI.created_id
+        response = api_client.post(f"{BASE_URL}/api/community-posts/{post_id}/like", headers=auth_headers)
+        assert response.json()["likes"] == 1
+        
+        response = api_client.delete(f"{BASE_URL}/api/community-posts/{post_id}/like", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["likes"] == 0
+        
+        response = api_client.post(f"{BASE_URL}/api/community-posts/{post_id}/like", headers=auth_headers)
+        assert response.json()["likes"] == 1
+    
+    def test_like_requires_auth(self, api_client):
+        """Anonymous likes are rejected"""
+        if not hasattr(TestCommunityPostsAPI, 'created_id'):
+            pytest.skip("No community post to like")
+        
+        post_id = TestCommunityPostsAPI.created_id
+        response = requests.post(f"{BASE_URL}/api/community-posts/{post_id}/like")
+        assert response.status_code == 401
+    
     def test_add_comment_to_post(self, api_client):
         """Test adding a comment to a community post"""
         if not hasattr(TestCommunityPostsAPI, 'created_id'):
@@ -256,7 +348,36 @@ class TestCommunityPostsAPI:
         assert "comment" in data
         assert data["comment"]["author"] == "TEST_Commenter"
         print(f"Comment added to post: {post_id}")
-    
+
+    def test_paginated_comments(self, api_client):
+        """Comments are paged newest first; the post keeps a bounded preview"""
+        if not hasattr(TestCommunityPostsAPI, 'created_id'):
+            pytest.skip("No community post to comment on")
+
+        post_id = TestCommunityPostsAPI.created_id
+        for i in range(5):
+            api_client.post(
+                f"{BASE_URL}/api/community-posts/{post_id}/comment",
+                json={"author": "TEST_Commenter", "content": f"Paged comment {i}"}
+            )
+
+        first = api_client.get(f"{BASE_URL}/api/community-posts/{post_id}/comments?limit=4").json()
+        assert len(first["comments"]) == 4
+        assert first["nextCursor"]
+        second = api_client.get(
+            f"{BASE_URL}/api/community-posts/{post_id}/comments?limit=4&cursor={first['nextCursor']}"
+        ).json()
+        assert len(second["comments"]) == 2
+        assert second["nextCursor"] is None
+        dates = [c["date"] for c in first["comments"] + second["comments"]]
+        assert dates == sorted(dates, reverse=True)
+
+        posts = api_client.get(f"{BASE_URL}/api/community-posts").json()
+        post = next(p for p in posts if p["id"] == post_id)
+        assert post["commentCount"] == 6
+        assert len(post["comments"]) == 3
+        print(f"Comments paginated for post: {post_id}")
+
     def test_delete_community_post(self, api_client):
         """Test deleting a community post"""
         if not hasattr(TestCommunityPostsAPI, 'created_id'):
@@ -271,6 +392,57 @@ class TestCommunityPostsAPI:
         print(f"Community post deleted: {post_id}")
 
 
+# ============= COMMUNITY STREAM TESTS =============
+
+def read_sse_events(response, count):
+    """Collect `count` events (as dicts of field -> value) from an SSE response"""
+    events, fields = [], {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            if not line.startswith(":"):
+                name, _, value = line.partition(": ")
+                fields[name] = value
+            continue
+        if "event" in fields:
+            events.append(fields)
+            if len(events) == count:
+                break
+        fields = {}
+    return events
+
+
+class TestCommunityStream:
+    """Tests for the community Server-Sent Events stream"""
+    
+    def test_post_event_is_pushed(self, api_client):
+        """Creating a post pushes post.created to connected clients"""
+        with requests.get(f"{BASE_URL}/api/community/stream", stream=True, timeout=10) as stream:
+            assert stream.status_code == 200
+            assert stream.headers.get("content-type", "").startswith("text/event-stream")
+            
+            created = api_client.post(f"{BASE_URL}/api/community-posts", json={
+                "authorName": "TEST_Stream", "content": "Streamed post"
+            }).json()
+            events = read_sse_events(stream, 1)
+        
+        assert events[0]["event"] == "post.created"
+        assert created["id"] in events[0]["data"]
+        TestCommunityStream.event_id = int(events[0]["id"])
+        TestCommunityStream.post_id = created["id"]
+    
+    def test_resume_with_last_event_id(self, api_client):
+        """Reconnecting with Last-Event-ID replays missed events"""
+        if not hasattr(TestCommunityStream, 'post_id'):
+            pytest.skip("No streamed post")
+        
+        api_client.delete(f"{BASE_URL}/api/community-posts/{TestCommunityStream.post_id}")
+        headers = {"Last-Event-ID": str(TestCommunityStream.event_id)}
+        with requests.get(f"{BASE_URL}/api/community/stream", headers=headers, stream=True, timeout=10) as stream:
+            events = read_sse_events(stream, 1)
+        assert events[0]["event"] == "post.deleted"
+        assert TestCommunityStream.post_id in events[0]["data"]
+
+
 # ============= CONTRACT TEMPLATES API TESTS =============
 
 class TestContractTemplatesAPI:
@@ -1,10 +1,12 @@
 """
 Backend API tests for Mother Natural payment endpoints
-Tests: /api/payments/config, /api/payments/process, /api/payments/order/{id}, /api/payments/history
+Tests: /api/payments/config, /api/payments/process, /api/payments/order/{id}, /api/payments/history,
+/api/checkout/quote
 """
 import pytest
 import requests
 import os
+import uuid
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 
@@ -121,5 +123,73 @@ class TestStatusEndpoint:
         print(f"✓ Status endpoint working - created and retrieved {len(statuses)} statuses")
 
 
+
+class TestCheckoutQuote:
+    """Test /api/checkout/quote server-side pricing"""
+    
+    @pytest.fixture(autouse=True)
+    def product(self):
+        """A product with size variants, deleted afterwards"""
+        response = requests.post(f"{BASE_URL}/api/products", json={
+            "name": f"TEST_Quote_{uuid.uuid4().hex[:8]}",
+            "price": 10.00,
+            "sizes": [{"name": "Large", "price": 19.99}]
+        })
+        self.product_id = response.json()["id"]
+        yield
+        requests.delete(f"{BASE_URL}/api/products/{self.product_id}")
+    
+    def test_quote_in_cents(self):
+        """Line totals, subtotal, tax and total are integer cents"""
+        tax = requests.get(f"{BASE_URL}/api/settings/tax").json()
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={"items": [
+            {"id": f"{self.product_id}-Large", "quantity": 3},
+            {"id": self.product_id, "quantity": 1}
+        ]})
+        
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert [i["lineTotal"] for i in data["items"]] == [5997, 1000]
+        assert data["subtotal"] == 6997
+        rate = tax["taxRate"] if tax["taxEnabled"] else 0
+        assert data["tax"] == int(6997 * rate + 0.5)
+        assert data["total"] == data["subtotal"] + data["tax"]
+        print(f"✓ Quote total: {data['total']} cents")
+    
+    def test_flavor_suffix_resolved(self):
+        """Cart ids carrying size and flavor suffixes price as the size variant"""
+        response = requests.post(f"{BASE_URL}/api/products", json={
+            "name": f"TEST_Quote_Flavor_{uuid.uuid4().hex[:8]}",
+            "price": 10.00,
+            "sizes": [{"name": "Extra-Large", "price": 24.50}],
+            "flavors": ["Earl-Grey"]
+        })
+        product_id = response.json()["id"]
+        try:
+            response = requests.post(f"{BASE_URL}/api/checkout/quote", json={"items": [
+                {"id": f"{product_id}-Extra-Large-Earl-Grey", "quantity": 1},
+                {"id": f"{product_id}-Earl-Grey", "quantity": 1}
+            ]})
+            assert response.status_code == 200, response.text
+            assert [i["lineTotal"] for i in response.json()["items"]] == [2450, 1000]
+        finally:
+            requests.delete(f"{BASE_URL}/api/products/{product_id}")
+
+    def test_unknown_item_rejected(self):
+        """Items that are not in the catalog cannot be quoted"""
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={"items": [{"id": "nonexistent"}]})
+        assert response.status_code == 400
+    
+    def test_payment_amount_must_match_quote(self):
+        """process_payment rejects cart amounts that differ from the quote"""
+        response = requests.post(f"{BASE_URL}/api/payments/process", json={
+            "sourceId": "cnon:card-nonce-ok",
+            "amount": 1,
+            "paymentType": "product",
+            "items": [{"id": self.product_id, "name": "TEST", "quantity": 1, "price": 1, "type": "product"}]
+        })
+        assert response.status_code == 400
+        assert "does not match" in response.json()["detail"]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])
@@ -308,5 +308,33 @@ class TestProductAPIBasics:
         print(f"✓ GET /api/categories returned {len(data)} categories")
 
 
+
+class TestRelatedProducts:
+    """Frequently-bought-together recommendations"""
+    
+    def test_related_for_unknown_product(self):
+        """Products with no co-purchases return an empty list"""
+        response = requests.get(f"{BASE_URL}/api/products/nonexistent-{uuid.uuid4().hex}/related")
+        assert response.status_code == 200
+        assert response.json() == []
+    
+    def test_related_sorted_by_count(self):
+        """Related products are ordered by co-purchase count"""
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        for product in products[:5]:
+            response = requests.get(f"{BASE_URL}/api/products/{product['id']}/related?limit=3&expand=true")
+            assert response.status_code == 200
+            related = response.json()
+            counts = [r["count"] for r in related]
+            assert len(related) <= 3
+            assert counts == sorted(counts, reverse=True)
+            assert all(r["id"] != product["id"] for r in related)
+        print(f"✓ Related products checked for {min(len(products), 5)} products")
+    
+    def test_rebuild_requires_admin(self):
+        """Rebuilding the index is admin only"""
+        response = requests.post(f"{BASE_URL}/api/admin/recommendations/rebuild")
+        assert response.status_code == 401
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])